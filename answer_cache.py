@@ -0,0 +1,111 @@
+from typing import Any, Callable, Dict, FrozenSet, Hashable, List, Tuple
+from query_cache import normalize_query
+from dotenv import load_dotenv
+from logger import Logger
+import threading
+import time
+import os
+
+load_dotenv()
+log = Logger()
+
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "512"))
+# Short because the generation only sees document changes made in this process, the TTL bounds staleness on other workers
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "300"))
+ANSWER_CACHE_EVICTION = os.environ.get("ANSWER_CACHE_EVICTION", "lru").lower()
+
+class AnswerCache:
+    """Reuses responder answers for repeated questions that retrieve exactly the same chunks.
+
+    Entries are keyed by the normalized question, the set of retrieved chunk ids and a key of the earlier conversation.
+    Questions are only matched exactly, since lexical similarity cannot tell "grade 5" from "grade 7". The whole cache
+    is dropped when the corpus generation changes."""
+
+    def __init__(self, generation: Callable[[], Hashable], maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL, eviction: str = ANSWER_CACHE_EVICTION) -> None:
+        if eviction not in ("lru", "lfu"):
+            raise ValueError(f"Unknown answer cache eviction policy: {eviction}")
+
+        self.generation = generation
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.eviction = eviction
+        self.entries: Dict[Tuple[str, FrozenSet[str], str], Dict[str, Any]] = {}
+        self.current_generation = generation()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def __sync_generation__(self, generation: Hashable) -> None:
+        if generation != self.current_generation:
+            self.entries.clear()
+            self.current_generation = generation
+            self.invalidations += 1
+            log.log_event("SYSTEM", "[ANSWER CACHE] Invalidated after a document change")
+
+    def __evict__(self) -> None:
+        # LRU drops the least recently used entry, LFU the least hit one with recency as the tie-break
+        if self.eviction == "lfu":
+            victim_key = lambda key: (self.entries[key]["hits"], self.entries[key]["last_used"])
+        else:
+            victim_key = lambda key: self.entries[key]["last_used"]
+
+        del self.entries[min(self.entries, key=victim_key)]
+        self.evictions += 1
+
+    def get(self, query: str, chunk_ids: List[str], context_key: str = "") -> Tuple[str | None, Hashable]:
+        """Returns the cached answer, or None, and the generation to pass back to put on a miss."""
+        generation = self.generation()
+        if self.maxsize <= 0 or not chunk_ids:
+            return None, generation
+
+        key = (normalize_query(query), frozenset(chunk_ids), context_key)
+        now = time.monotonic()
+        with self.lock:
+            self.__sync_generation__(generation)
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires"] <= now:
+                del self.entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None, generation
+
+            entry["hits"] += 1
+            entry["last_used"] = now
+            self.hits += 1
+            return entry["answer"], generation
+
+    def put(self, query: str, chunk_ids: List[str], answer: str | None, generation: Hashable, context_key: str = "") -> None:
+        if self.maxsize <= 0 or not chunk_ids or not answer:
+            return
+
+        key = (normalize_query(query), frozenset(chunk_ids), context_key)
+        now = time.monotonic()
+        with self.lock:
+            # An answer generated while the documents changed may already be stale, so it is not kept
+            if generation != self.generation():
+                return
+            self.__sync_generation__(generation)
+
+            self.entries[key] = {"answer": answer, "expires": now + self.ttl, "hits": 0, "last_used": now}
+
+            while len(self.entries) > self.maxsize:
+                self.__evict__()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "eviction": self.eviction,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,48 @@
+from typing import Iterable, Iterator, Tuple
+from functools import lru_cache
+import tiktoken
+
+ENCODING_NAME = "cl100k_base"
+
+@lru_cache(maxsize=None)
+def get_encoder(name: str = ENCODING_NAME) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(name)
+
+def count_tokens(text: str) -> int:
+    return len(get_encoder().encode_ordinary(text))
+
+class Chunk:
+    def __init__(self, text: str, page: int, ordinal: int, token_start: int, token_end: int) -> None:
+        self.text = text
+        self.page = page
+        self.ordinal = ordinal
+        self.token_start = token_start
+        self.token_end = token_end
+
+class Chunker:
+    def __init__(self, max_tokens: int = 250, overlap: int = 100, encoding: str = ENCODING_NAME) -> None:
+        if overlap >= max_tokens:
+            raise ValueError("overlap must be smaller than max_tokens")
+
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.encoder = get_encoder(encoding)
+
+    def chunk_text(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        tokens = self.encoder.encode_ordinary(text)
+        if not tokens:
+            return
+
+        # Decode once and slice by character offsets instead of decoding every window
+        decoded, offsets = self.encoder.decode_with_offsets(tokens)
+        step = self.max_tokens - self.overlap
+
+        for start in range(0, len(tokens), step):
+            end = min(start + self.max_tokens, len(tokens))
+            char_end = offsets[end] if end < len(tokens) else len(decoded)
+            yield start, end, decoded[offsets[start]:char_end]
+
+    def chunk_pages(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Chunk]:
+        for page, text in pages:
+            for ordinal, (token_start, token_end, chunk_text) in enumerate(self.chunk_text(text)):
+                yield Chunk(text=chunk_text, page=page, ordinal=ordinal, token_start=token_start, token_end=token_end)
@@ -0,0 +1,60 @@
+from clip.simple_tokenizer import SimpleTokenizer as ClipTokenizer
+from dotenv import load_dotenv
+from logger import Logger
+from typing import Any, Tuple
+import threading
+import torch
+import clip
+import os
+
+load_dotenv()
+log = Logger()
+
+CLIP_MODEL = os.environ.get("CLIP_MODEL", "ViT-B/32")
+CLIP_DEVICE = os.environ.get("CLIP_DEVICE", "")
+CLIP_THREADS = int(os.environ.get("CLIP_THREADS", "0"))
+CLIP_BATCH_SIZE = int(os.environ.get("CLIP_BATCH_SIZE", "32"))
+CLIP_WARMUP = os.environ.get("CLIP_WARMUP", "false").lower() == "true"
+
+class ClipRegistry:
+    def __init__(self, model_name: str = CLIP_MODEL, device: str = CLIP_DEVICE, threads: int = CLIP_THREADS) -> None:
+        self.model_name = model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.threads = threads
+        self.model: Any = None
+        self.preprocess: Any = None
+        self.tokenizer: Any = None
+        self.lock = threading.Lock()
+
+    def load(self) -> Tuple[Any, Any]:
+        if self.model is None:
+            with self.lock:
+                # Another thread may have finished loading while we waited on the lock
+                if self.model is None:
+                    if self.threads > 0:
+                        torch.set_num_threads(self.threads)
+
+                    model, preprocess = clip.load(self.model_name, device=self.device)
+                    model.eval()
+
+                    self.preprocess = preprocess
+                    self.model = model
+                    log.log_event("SYSTEM", f"[CLIP] Loaded {self.model_name} on {self.device} (threads={torch.get_num_threads()})")
+
+        return self.model, self.preprocess
+
+    def get_tokenizer(self) -> ClipTokenizer:
+        if self.tokenizer is None:
+            with self.lock:
+                if self.tokenizer is None:
+                    self.tokenizer = ClipTokenizer()
+        return self.tokenizer
+
+    def warmup(self) -> None:
+        model, _ = self.load()
+
+        with torch.no_grad():
+            model.encode_text(clip.tokenize("warmup").to(self.device))
+        log.log_event("SYSTEM", "[CLIP] Warmup complete")
+
+clip_registry = ClipRegistry()
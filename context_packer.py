@@ -0,0 +1,151 @@
+from typing import Any, Dict, List, Tuple
+from chunker import get_encoder
+from dotenv import load_dotenv
+from logger import Logger
+import os
+
+load_dotenv()
+log = Logger()
+
+CONTEXT_DOCUMENT_TOKENS = int(os.environ.get("CONTEXT_DOCUMENT_TOKENS", "1200"))
+CONTEXT_RETRIEVAL_TOKENS = int(os.environ.get("CONTEXT_RETRIEVAL_TOKENS", "1600"))
+CONTEXT_HISTORY_TOKENS = int(os.environ.get("CONTEXT_HISTORY_TOKENS", "800"))
+CONTEXT_MIN_DESCRIPTION_TOKENS = int(os.environ.get("CONTEXT_MIN_DESCRIPTION_TOKENS", "60"))
+
+class PackedContext:
+    def __init__(self, document_context: str, rag_answer: str | None, history: str, token_counts: Dict[str, int], dropped: Dict[str, int]) -> None:
+        self.document_context = document_context
+        self.rag_answer = rag_answer
+        self.history = history
+        self.token_counts = token_counts
+        self.dropped = dropped
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.token_counts.values())
+
+class ContextPacker:
+    """Packs document descriptions, retrieved passages and chat history into fixed token budgets.
+
+    Each section is filled in priority order: passages by retrieval rank, history from the newest
+    message back, descriptions with an equal share each so one long summary cannot crowd out the rest."""
+
+    def __init__(self, document_tokens: int = CONTEXT_DOCUMENT_TOKENS, retrieval_tokens: int = CONTEXT_RETRIEVAL_TOKENS, history_tokens: int = CONTEXT_HISTORY_TOKENS) -> None:
+        self.document_tokens = document_tokens
+        self.retrieval_tokens = retrieval_tokens
+        self.history_tokens = history_tokens
+        self.encoder = get_encoder()
+        self.document_cache: Tuple[Tuple[str, ...], Tuple[str, int]] | None = None
+
+    def __truncate__(self, text: str, max_tokens: int) -> str:
+        tokens = self.encoder.encode_ordinary(text)
+        if len(tokens) <= max_tokens:
+            return text
+        # The ellipsis counts against the budget too
+        return self.encoder.decode(tokens[:max(0, max_tokens - self.__count__("..."))]).rstrip() + "..."
+
+    def __count__(self, text: str) -> int:
+        return len(self.encoder.encode_ordinary(text))
+
+    def __trim_overlap__(self, kept: List[str], text: str, min_overlap: int = 32) -> str:
+        # Drops a chunk that is already contained in a kept one, or the prefix it shares with the end of one
+        for previous in kept:
+            if text in previous:
+                return ""
+            anchor = text[:min_overlap]
+            if len(anchor) < min_overlap:
+                continue
+            position = previous.find(anchor)
+            while position != -1:
+                if text.startswith(previous[position:]):
+                    return text[len(previous) - position:].lstrip()
+                position = previous.find(anchor, position + 1)
+        return text
+
+    def pack_documents(self, descriptions: List[str]) -> Tuple[str, int]:
+        if not descriptions:
+            return "", 0
+
+        # The packed descriptions lead every prompt, so they are reused as-is until the descriptions change
+        key = tuple(descriptions)
+        if self.document_cache is not None and self.document_cache[0] == key:
+            return self.document_cache[1]
+
+        share = max(self.document_tokens // len(descriptions), CONTEXT_MIN_DESCRIPTION_TOKENS)
+        lines: List[str] = []
+        used = 0
+
+        for i, description in enumerate(descriptions):
+            line = f"Document {i+1}: {self.__truncate__(description, share)}\n"
+            tokens = self.__count__(line + "\n")
+            if used + tokens > self.document_tokens:
+                break
+            lines.append(line)
+            used += tokens
+
+        self.document_cache = (key, ("\n".join(lines), len(lines)))
+        return self.document_cache[1]
+
+    def pack_passages(self, passages: List[Dict[str, Any]]) -> Tuple[str | None, int]:
+        if not passages:
+            return None, 0
+
+        kept: List[str] = []
+        answers: List[str] = []
+        used = 0
+
+        for passage in passages:
+            fields = passage["fields"]
+            text = self.__trim_overlap__(kept, fields.get("text", ""))
+            if not text:
+                continue
+
+            citation = f" ({fields['source']}, page {fields['page_no']})" if fields.get("page_no") else ""
+            prefix = f"Answer {len(answers)+1}{citation}: "
+            remaining = self.retrieval_tokens - used - self.__count__(prefix) - self.__count__(" \n\n")
+            if remaining <= 0:
+                break
+
+            # Lower-ranked passages give way first, only the last one that fits is cut short
+            text = self.__truncate__(text, remaining)
+            kept.append(fields.get("text", ""))
+            answer = f"{prefix}{text} \n"
+            answers.append(answer)
+            used += self.__count__(answer + "\n")
+
+        return "\n".join(answers), len(answers)
+
+    def pack_history(self, messages: List[Dict[str, Any]]) -> Tuple[str, int]:
+        lines: List[str] = []
+        used = 0
+
+        for message in reversed(messages):
+            sender_label = "[User]" if message["sender"] == "user" else "[LLM]"
+            remaining = self.history_tokens - used - self.__count__(f"{sender_label}: \n\n")
+            if remaining <= 0:
+                break
+
+            line = f"{sender_label}: {self.__truncate__(message['content'], remaining)}\n\n"
+            lines.append(line)
+            used += self.__count__(line)
+
+        return "".join(reversed(lines)), len(lines)
+
+    def pack(self, descriptions: List[str], passages: List[Dict[str, Any]] | None, messages: List[Dict[str, Any]]) -> PackedContext:
+        document_context, documents_kept = self.pack_documents(descriptions)
+        rag_answer, passages_kept = self.pack_passages(passages or [])
+        history, messages_kept = self.pack_history(messages)
+
+        token_counts = {
+            "document_context": self.__count__(document_context),
+            "retrieval": self.__count__(rag_answer or ""),
+            "history": self.__count__(history),
+        }
+        dropped = {
+            "documents": len(descriptions) - documents_kept,
+            "passages": len(passages or []) - passages_kept,
+            "messages": len(messages) - messages_kept,
+        }
+
+        log.log_event("SYSTEM", f"[CONTEXT] Packed {sum(token_counts.values())} tokens {token_counts}")
+        return PackedContext(document_context=document_context, rag_answer=rag_answer, history=history, token_counts=token_counts, dropped=dropped)
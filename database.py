@@ -286,6 +286,9 @@ class Document(Base):
     upload_timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
     images = relationship("Image", back_populates="document", cascade="all, delete-orphan")
+    pages = relationship("DocumentPage", back_populates="document", cascade="all, delete-orphan")
+    image_hashes = relationship("ImageHash", back_populates="document", cascade="all, delete-orphan")
+    file = relationship("DocumentFile", back_populates="document", cascade="all, delete-orphan", uselist=False)
 
     def mark_vectorized(self, session) -> None:
         self.vectorized = True
@@ -331,13 +334,264 @@ class Document(Base):
     
     @classmethod
     def get_all_descriptions(cls, session) -> str:
-        docs = session.query(cls.description).all()
+        # Documents still being ingested have no summary yet
+        docs = session.query(cls.description).filter(cls.description.isnot(None)).all()
         descriptions = [doc[0] for doc in docs]
         return "\n".join([f"Document {i+1}: {item}\n" for i, item in enumerate(descriptions)])
 
+    @classmethod
+    def get_description_list(cls, session) -> list[str]:
+        # Ordered so the packed descriptions, and the prompt prefix built from them, are identical between calls
+        docs = session.query(cls.description).filter(cls.description.isnot(None)).order_by(cls.document_id).all()
+        return [doc[0] for doc in docs]
+
+    @classmethod
+    def get_by_name(cls, session, name) -> dict | None:
+        document = session.query(cls).filter_by(name=name).order_by(cls.document_id.desc()).first()
+
+        if not document:
+            return None
+        return document.to_dict()
+
+    @classmethod
+    def get_by_id(cls, session, document_id) -> dict | None:
+        document = session.get(cls, document_id)
+        return document.to_dict() if document else None
+
+    @classmethod
+    def get_vector_ids(cls, session, document_id) -> dict:
+        pages = session.query(DocumentPage.vector_ids).filter_by(document_id=document_id).all()
+        images = session.query(ImageHash.vector_id).filter(ImageHash.document_id == document_id, ImageHash.vector_id.isnot(None)).all()
+        return {
+            "text": [vector_id for page in pages for vector_id in json.loads(page[0])],
+            "images": [image[0] for image in images],
+        }
+
+    @classmethod
+    def delete_document(cls, session, document_id) -> bool:
+        document = session.get(cls, document_id)
+        if not document:
+            return False
+
+        # Fingerprints have no relationship on the document so they are not covered by the cascade
+        session.query(ImageFingerprint).filter_by(document_id=document_id).delete(synchronize_session=False)
+        session.delete(document)
+        session.commit()
+        return True
+
+    def to_dict(self) -> dict:
+        return {
+            "document_id": self.document_id,
+            "name": self.name,
+            "path": self.path,
+            "description": self.description,
+        }
+
+class DocumentPage(Base):
+    __tablename__ = 'document_pages'
+
+    page_id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey('documents.document_id'), nullable=False)
+    page_no = Column(Integer, nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    vector_ids = Column(Text, nullable=False, default="[]")
+
+    document = relationship("Document", back_populates="pages")
+
+    @classmethod
+    def get_hashes(cls, session, document_id) -> dict:
+        pages = session.query(cls).filter_by(document_id=document_id).all()
+        return {
+            page.page_no: {
+                "content_hash": page.content_hash,
+                "vector_ids": json.loads(page.vector_ids),
+            }
+            for page in pages
+        }
+
+    @classmethod
+    def save_hashes(cls, session, document_id, pages: dict) -> None:
+        existing = {page.page_no: page for page in session.query(cls).filter(cls.document_id == document_id, cls.page_no.in_(list(pages))).all()}
+
+        for page_no, (content_hash, vector_ids) in pages.items():
+            page = existing.get(page_no)
+            if page is None:
+                page = cls(document_id=document_id, page_no=page_no)
+                session.add(page)
+            page.content_hash = content_hash
+            page.vector_ids = json.dumps(vector_ids)
+
+        session.commit()
+
+    @classmethod
+    def delete_hashes(cls, session, document_id, page_nos) -> None:
+        session.query(cls).filter(cls.document_id == document_id, cls.page_no.in_(list(page_nos))).delete(synchronize_session=False)
+        session.commit()
+
+class DocumentFile(Base):
+    __tablename__ = 'document_files'
+
+    file_id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey('documents.document_id'), nullable=False, unique=True)
+    content_hash = Column(String(64), nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+    timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    document = relationship("Document", back_populates="file")
+
+    @classmethod
+    def get_hash(cls, session, document_id) -> str | None:
+        document_file = session.query(cls).filter_by(document_id=document_id).first()
+        return document_file.content_hash if document_file else None
+
+    @classmethod
+    def save_hash(cls, session, document_id, content_hash, size_bytes) -> None:
+        document_file = session.query(cls).filter_by(document_id=document_id).first()
+
+        if document_file is None:
+            document_file = cls(document_id=document_id)
+            session.add(document_file)
+        document_file.content_hash = content_hash
+        document_file.size_bytes = size_bytes
+        document_file.timestamp = datetime.now(timezone.utc)
+        session.commit()
+
+class ImageHash(Base):
+    __tablename__ = 'image_hashes'
+
+    image_hash_id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey('documents.document_id'), nullable=False)
+    page_no = Column(Integer, nullable=False)
+    image_no = Column(Integer, nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    vector_id = Column(String, nullable=True)
+
+    document = relationship("Document", back_populates="image_hashes")
+
+    @classmethod
+    def get_hashes(cls, session, document_id) -> dict:
+        images = session.query(cls).filter_by(document_id=document_id).all()
+        return {
+            (image.page_no, image.image_no): {
+                "content_hash": image.content_hash,
+                "vector_id": image.vector_id,
+            }
+            for image in images
+        }
+
+    @classmethod
+    def save_hashes(cls, session, document_id, images: dict) -> None:
+        existing = {(image.page_no, image.image_no): image for image in session.query(cls).filter_by(document_id=document_id).all()}
+
+        for key, (content_hash, vector_id) in images.items():
+            image = existing.get(key)
+            if image is None:
+                image = cls(document_id=document_id, page_no=key[0], image_no=key[1])
+                session.add(image)
+            image.content_hash = content_hash
+            image.vector_id = vector_id
+
+        session.commit()
+
+    @classmethod
+    def delete_hashes(cls, session, document_id, keys) -> None:
+        keys = set(keys)
+        for image in session.query(cls).filter_by(document_id=document_id).all():
+            if (image.page_no, image.image_no) in keys:
+                session.delete(image)
+        session.commit()
+
+    @classmethod
+    def get_references(cls, session, vector_ids) -> list[dict]:
+        # Duplicate images store the vector of the image they were matched to, and each document using a vector
+        # keeps a fingerprint row with its description
+        images = session.query(cls).filter(cls.vector_id.in_(list(vector_ids))).order_by(cls.document_id, cls.page_no, cls.image_no).all()
+        fingerprints = session.query(ImageFingerprint).filter(ImageFingerprint.vector_id.in_(list(vector_ids))).all()
+        descriptions = {(fingerprint.document_id, fingerprint.vector_id): fingerprint.description for fingerprint in fingerprints}
+        return [
+            {
+                "document_id": image.document_id,
+                "page_no": image.page_no,
+                "image_no": image.image_no,
+                "vector_id": image.vector_id,
+                "description": descriptions.get((image.document_id, image.vector_id)),
+            }
+            for image in images
+        ]
+
+    @classmethod
+    def move_references(cls, session, vector_id, new_vector_id, document_ids) -> None:
+        for model in (cls, ImageFingerprint):
+            session.query(model).filter(model.vector_id == vector_id, model.document_id.in_(list(document_ids))).update({model.vector_id: new_vector_id}, synchronize_session=False)
+        session.commit()
+
+class ImageFingerprint(Base):
+    __tablename__ = 'image_fingerprints'
+
+    fingerprint_id = Column(Integer, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey('documents.document_id'), nullable=False)
+    perceptual_hash = Column(String(16), nullable=False)
+    description = Column(Text, nullable=True)
+    vector_id = Column(String, nullable=False)
+    timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    @classmethod
+    def get_all(cls, session) -> list[dict]:
+        fingerprints = session.query(cls).all()
+        return [
+            {
+                "document_id": fingerprint.document_id,
+                "perceptual_hash": fingerprint.perceptual_hash,
+                "description": fingerprint.description,
+                "vector_id": fingerprint.vector_id,
+            }
+            for fingerprint in fingerprints
+        ]
+
+    @classmethod
+    def add_fingerprints(cls, session, document_id, fingerprints: list[dict]) -> None:
+        for fingerprint in fingerprints:
+            session.add(cls(document_id=document_id, **fingerprint))
+        session.commit()
+
+    @classmethod
+    def delete_by_vector_ids(cls, session, document_id, vector_ids) -> None:
+        # Other documents keep their own rows for the same vector, see ImageHash.get_references
+        session.query(cls).filter(cls.document_id == document_id, cls.vector_id.in_(list(vector_ids))).delete(synchronize_session=False)
+        session.commit()
+
+class SectionSummary(Base):
+    __tablename__ = 'section_summaries'
+
+    section_id = Column(Integer, primary_key=True, autoincrement=True)
+    content_hash = Column(String(64), nullable=False, unique=True)
+    summary = Column(Text, nullable=False)
+    timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    @classmethod
+    def get_summaries(cls, session, content_hashes) -> dict:
+        sections = session.query(cls).filter(cls.content_hash.in_(list(content_hashes))).all()
+        return {section.content_hash: section.summary for section in sections}
+
+    @classmethod
+    def save_summaries(cls, session, summaries: dict) -> None:
+        existing = {section.content_hash: section for section in session.query(cls).filter(cls.content_hash.in_(list(summaries))).all()}
+
+        for content_hash, summary in summaries.items():
+            section = existing.get(content_hash)
+            if section is None:
+                section = cls(content_hash=content_hash)
+                session.add(section)
+            section.summary = summary
+            section.timestamp = datetime.now(timezone.utc)
+
+        session.commit()
+
 class DBHandler:
     def __init__(self) -> None:
         self.engine, self.Session = self.__connect__()
+        # Bumped whenever a document or its description changes, so callers can cache the description list
+        self.descriptions_version = 0
 
     def __connect__(self) -> Tuple:
         load_dotenv()
@@ -543,6 +797,7 @@ class DBHandler:
         try:
             with self.Session() as session:
                 document = Document.insert_document(session=session, path=path, description=description, vectorized=vectorized)
+                self.descriptions_version += 1
                 log.log_event("SYSTEM", f"[DATABASE] New document inserted.")
                 return document
         except Exception as excp:
@@ -559,6 +814,162 @@ class DBHandler:
                 log.log_event("SYSTEM", f"[DATABASE] Retrieval of document descriptions failed. {excp}")
                 return None
 
+    def get_doc_description_list(self) -> list[str] | None:
+        try:
+            with self.Session() as session:
+                descriptions = Document.get_description_list(session=session)
+                log.log_event("SYSTEM", f"[DATABASE] Retrieved all document descriptions.")
+                return descriptions
+        except Exception as excp:
+                log.log_event("SYSTEM", f"[DATABASE] Retrieval of document descriptions failed. {excp}")
+                return None
+
+    def get_document_by_name(self, name) -> dict | None:
+        # Returns an empty dict when no document has the name, None only when the lookup itself failed
+        try:
+            with self.Session() as session:
+                document = Document.get_by_name(session=session, name=name)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Document lookup failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Document lookup for {name} {'found' if document else 'not found'}.")
+        return document or {}
+
+    def get_document(self, document_id) -> dict | None:
+        try:
+            with self.Session() as session:
+                document = Document.get_by_id(session=session, document_id=document_id)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Document lookup failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Document lookup for {document_id} {'found' if document else 'not found'}.")
+        return document
+
+    def get_document_vector_ids(self, document_id) -> dict | None:
+        try:
+            with self.Session() as session:
+                vector_ids = Document.get_vector_ids(session=session, document_id=document_id)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Document vector id retrieval failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Document vector ids retrieved.")
+        return vector_ids
+
+    def delete_document(self, document_id) -> bool | None:
+        try:
+            with self.Session() as session:
+                deleted = Document.delete_document(session=session, document_id=document_id)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Document deletion failed. {excp}")
+            return None
+
+        if not deleted:
+            log.log_event("SYSTEM", f"[DATABASE] Document deletion failed. Document does not exist.")
+            return None
+
+        self.descriptions_version += 1
+        log.log_event("SYSTEM", f"[DATABASE] Document {document_id} deleted.")
+        return True
+
+    def update_document_description(self, document_id, description) -> bool | None:
+        try:
+            with self.Session() as session:
+                document: Document | None = session.get(Document, document_id)
+
+                if document:
+                    document.description = description
+                    session.commit()
+                    self.descriptions_version += 1
+                else:
+                    log.log_event("SYSTEM", f"[DATABASE] Document description update failed. Document does not exist.")
+                    return None
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Document description update failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Document description updated.")
+        return True
+
+    def get_document_file_hash(self, document_id) -> str | None:
+        try:
+            with self.Session() as session:
+                content_hash = DocumentFile.get_hash(session=session, document_id=document_id)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Document file hash retrieval failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Document file hash retrieved.")
+        return content_hash
+
+    def save_document_file_hash(self, document_id, content_hash, size_bytes) -> bool | None:
+        try:
+            with self.Session() as session:
+                DocumentFile.save_hash(session=session, document_id=document_id, content_hash=content_hash, size_bytes=size_bytes)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Document file hash update failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Document file hash saved.")
+        return True
+
+    def get_page_hashes(self, document_id) -> dict | None:
+        try:
+            with self.Session() as session:
+                pages = DocumentPage.get_hashes(session=session, document_id=document_id)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Page hash retrieval failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Page hashes retrieved.")
+        return pages
+
+    def save_page_hashes(self, document_id, pages: dict) -> bool | None:
+        try:
+            with self.Session() as session:
+                DocumentPage.save_hashes(session=session, document_id=document_id, pages=pages)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Page hash update failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] {len(pages)} page hashes saved.")
+        return True
+
+    def delete_page_hashes(self, document_id, page_nos) -> bool | None:
+        try:
+            with self.Session() as session:
+                DocumentPage.delete_hashes(session=session, document_id=document_id, page_nos=page_nos)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Page hash deletion failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Page hashes deleted.")
+        return True
+
+    def get_section_summaries(self, content_hashes) -> dict | None:
+        try:
+            with self.Session() as session:
+                summaries = SectionSummary.get_summaries(session=session, content_hashes=content_hashes)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Section summary retrieval failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] {len(summaries)} cached section summaries retrieved.")
+        return summaries
+
+    def save_section_summaries(self, summaries: dict) -> bool | None:
+        try:
+            with self.Session() as session:
+                SectionSummary.save_summaries(session=session, summaries=summaries)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Section summary update failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] {len(summaries)} section summaries saved.")
+        return True
+
     ######################
     # Image class handling
     def get_image_path_by_id(self, image_id) -> str | None:
@@ -594,6 +1005,94 @@ class DBHandler:
         
         log.log_event("SYSTEM", f"[DATABASE] Image insertion successful.")
         return image
+
+    def get_image_fingerprints(self) -> list[dict] | None:
+        try:
+            with self.Session() as session:
+                fingerprints = ImageFingerprint.get_all(session=session)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Image fingerprint retrieval failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] {len(fingerprints)} image fingerprints retrieved.")
+        return fingerprints
+
+    def add_image_fingerprints(self, document_id, fingerprints: list[dict]) -> bool | None:
+        try:
+            with self.Session() as session:
+                ImageFingerprint.add_fingerprints(session=session, document_id=document_id, fingerprints=fingerprints)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Image fingerprint insertion failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] {len(fingerprints)} image fingerprints saved.")
+        return True
+
+    def delete_image_fingerprints(self, document_id, vector_ids) -> bool | None:
+        try:
+            with self.Session() as session:
+                ImageFingerprint.delete_by_vector_ids(session=session, document_id=document_id, vector_ids=vector_ids)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Image fingerprint deletion failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Image fingerprints deleted.")
+        return True
+
+    def get_image_references(self, vector_ids) -> list[dict] | None:
+        try:
+            with self.Session() as session:
+                references = ImageHash.get_references(session=session, vector_ids=vector_ids)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Image reference retrieval failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] {len(references)} image references retrieved.")
+        return references
+
+    def move_image_references(self, vector_id, new_vector_id, document_ids) -> bool | None:
+        try:
+            with self.Session() as session:
+                ImageHash.move_references(session=session, vector_id=vector_id, new_vector_id=new_vector_id, document_ids=document_ids)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Image reference update failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Image references moved to {new_vector_id}.")
+        return True
+
+    def get_image_hashes(self, document_id) -> dict | None:
+        try:
+            with self.Session() as session:
+                images = ImageHash.get_hashes(session=session, document_id=document_id)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Image hash retrieval failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Image hashes retrieved.")
+        return images
+
+    def save_image_hashes(self, document_id, images: dict) -> bool | None:
+        try:
+            with self.Session() as session:
+                ImageHash.save_hashes(session=session, document_id=document_id, images=images)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Image hash update failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] {len(images)} image hashes saved.")
+        return True
+
+    def delete_image_hashes(self, document_id, keys) -> bool | None:
+        try:
+            with self.Session() as session:
+                ImageHash.delete_hashes(session=session, document_id=document_id, keys=keys)
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[DATABASE] Image hash deletion failed. {excp}")
+            return None
+
+        log.log_event("SYSTEM", f"[DATABASE] Image hashes deleted.")
+        return True
     
 
 # db = DBHandler()
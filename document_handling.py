@@ -1,21 +1,26 @@
-from clip.simple_tokenizer import SimpleTokenizer as ClipTokenizer
-from typing import cast, Optional, Any
-from typing import List, Dict, Tuple
+from clip.simple_tokenizer import basic_clean, whitespace_clean
+from document_parser import ParsedDocument, ParsedPage, ParsedImage
+from chunker import Chunker, count_tokens
+from clip_registry import clip_registry, CLIP_BATCH_SIZE
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import cast, Optional, Any, Callable
+from typing import List, Dict, Tuple, Set, Iterable, Iterator
 import torch.nn.functional as F
 from dotenv import load_dotenv
 from database import DBHandler
-from pinecone import Pinecone
+from vector_store import create_vector_stores, VectorStore
+from query_cache import QueryCache, normalize_query
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from reranker import CrossScorer, rerank, merge_passages
 from logger import Logger
-from pathlib import Path
 from torch import Tensor 
 from blob import Blob
 from PIL import Image
+from pipeline import batched
 from llm import LLM
-import tiktoken
+import hashlib
+import glob
 import torch
-import fitz
-import uuid
-import clip
 import os
 import re
 
@@ -23,35 +28,50 @@ load_dotenv()
 blob = Blob()
 log = Logger()
 
+IMAGE_DESCRIPTION_CONCURRENCY = int(os.environ.get("IMAGE_DESCRIPTION_CONCURRENCY", "8"))
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "250"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "100"))
+IMAGE_DEDUP_DISTANCE = int(os.environ.get("IMAGE_DEDUP_DISTANCE", "4"))
+SUMMARY_SECTION_TOKENS = int(os.environ.get("SUMMARY_SECTION_TOKENS", "6000"))
+SUMMARY_SECTION_PAGES = int(os.environ.get("SUMMARY_SECTION_PAGES", "8"))
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", "4"))
+HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "true").lower() == "true"
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.environ.get("RRF_K", "60"))
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "12"))
+RETRIEVAL_PASSAGES = int(os.environ.get("RETRIEVAL_PASSAGES", "2"))
+NEIGHBOUR_EXPANSION = os.environ.get("NEIGHBOUR_EXPANSION", "true").lower() == "true"
+
+PASSAGE_FIELDS = ["text", "source", "page_no", "chunk_no", "token_start", "token_end", "document_id"]
+
+# Vector ids are derived from the document row so a document's vectors can be found, replaced and deleted
+def document_vector_prefix(namespace: str, document_id: int) -> str:
+    return f"{namespace}-{document_id}-"
+
+def text_vector_id(namespace: str, document_id: int, page_no: int, chunk_no: int) -> str:
+    return f"{document_vector_prefix(namespace, document_id)}p{page_no}-c{chunk_no}"
+
+def image_vector_id(namespace: str, document_id: int, page_no: int, image_no: int) -> str:
+    return f"{document_vector_prefix(namespace, document_id)}p{page_no}-i{image_no}"
+
+def image_vector_owner(namespace: str, vector_id: str) -> int | None:
+    # Duplicate images store the vector of the document they were matched to, legacy ids have no owner
+    match = re.fullmatch(rf"{re.escape(namespace)}-(\d+)-p\d+-i\d+", vector_id)
+    return int(match.group(1)) if match else None
+
 class Document:
     def __init__(self) -> None:
         log.log_event("SYSTEM", "Document class Initialized")
-        self.pc = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
-        self.index = self.pc.Index(str(os.environ.get("PINECONE_INDEX_NAME")))
-        self.index_images = self.pc.Index(str(os.environ.get("PINECONE_IMAGES_INDEX_NAME")))
-        log.log_event("SYSTEM", "Connected to PineconeDB")
+        self.text_store, self.image_store = create_vector_stores()
+        self.chunker = Chunker(max_tokens=CHUNK_MAX_TOKENS, overlap=CHUNK_OVERLAP_TOKENS)
+        self.query_cache = QueryCache()
+        self.lexical_index = LexicalIndex()
+        self.search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-search")
 
     def __clean_text__(self, text: str) -> str:
         text = re.sub(r'\s+', ' ', text)  
         return text.strip()    
     
-    def __tokenize__(self, text, max_tokens=250, overlap=100) -> list:
-        enc = tiktoken.get_encoding("cl100k_base")
-        tokens = enc.encode(text=text)
-
-        chunks = []
-        start = 0
-
-        while start < len(tokens):
-            end = start + max_tokens
-            chunk = tokens[start:end]
-            decoded_chunk = enc.decode(chunk)
-            
-            chunks.append(decoded_chunk)
-            start += max_tokens - overlap
-        
-        return chunks
-
     def __get_page_text_context__(self, page_text: str, total_images: int, img_index: int, context_chars: int = 500) -> Tuple[str, str]:
         if not page_text.strip():
             return "", ""
@@ -74,31 +94,15 @@ class Document:
         
         return text_before.strip(), text_after.strip()
     
-    def __get_text_context_around_image__(self, page, img_rect, page_text: str, context_chars: int = 500) -> Tuple[str, str]:
-        text_blocks = page.get_text("dict")
-        
+    def __get_text_context_around_image__(self, text_blocks: List[Tuple[Tuple[float, float, float, float], str]], img_bbox: Tuple[float, float, float, float], context_chars: int = 500) -> Tuple[str, str]:
         text_before_img = []
         text_after_img = []
 
-        for block in text_blocks["blocks"]:
-            if "lines" not in block:
-                continue
-                
-            block_rect = fitz.Rect(block["bbox"])
-
-            if block_rect.y1 < img_rect.y0:
-                block_text = ""
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        block_text += span["text"] + " "
-                text_before_img.append(block_text.strip())
-                
-            elif block_rect.y0 > img_rect.y1:
-                block_text = ""
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        block_text += span["text"] + " "
-                text_after_img.append(block_text.strip())
+        for block_bbox, block_text in text_blocks:
+            if block_bbox[3] < img_bbox[1]:
+                text_before_img.append(block_text)
+            elif block_bbox[1] > img_bbox[3]:
+                text_after_img.append(block_text)
 
         context_before = " ".join(text_before_img)
         context_after = " ".join(text_after_img)
@@ -112,245 +116,491 @@ class Document:
         return context_before, context_after
     
     def __truncate_for_clip__(self, text: str, max_tokens: int = 75) -> str:
-        tokenizer = ClipTokenizer()
-        words = text.strip().split()
-        
-        low, high = 0, len(words)
-        best = ""
-        
-        while low <= high:
-            mid = (low + high) // 2
-            candidate = " ".join(words[:mid])
-            token_count = len(tokenizer.encode(candidate))
-
-            if token_count <= max_tokens:
-                best = candidate
-                low = mid + 1
-            else:
-                high = mid - 1
-
-        return best if best else text[:max_tokens]
+        return self.truncate_for_clip([text], max_tokens=max_tokens)[0][0]
+
+    def truncate_for_clip(self, texts: List[str], max_tokens: int = 75) -> List[Tuple[str, List[int]]]:
+        tokenizer = clip_registry.get_tokenizer()
+        truncated = []
+
+        for text in texts:
+            # Same cleaning as SimpleTokenizer.encode, applied once; BPE never crosses whitespace so words can be counted independently
+            words = whitespace_clean(basic_clean(text)).lower().split()
+            tokens: List[int] = []
+            kept = 0
+
+            for word in words:
+                word_tokens = [
+                    tokenizer.encoder[bpe_token]
+                    for piece in tokenizer.pat.findall(word)
+                    for bpe_token in tokenizer.bpe("".join(tokenizer.byte_encoder[b] for b in piece.encode("utf-8"))).split(" ")
+                ]
+                if len(tokens) + len(word_tokens) > max_tokens:
+                    if kept == 0:
+                        tokens = word_tokens[:max_tokens]
+                    break
+                tokens.extend(word_tokens)
+                kept += 1
+
+            truncated.append((" ".join(words[:kept]) if kept else text[:max_tokens], tokens))
+
+        return truncated
+
+    def __clip_text_input__(self, texts: List[str], context_length: int = 77) -> Tensor:
+        tokenizer = clip_registry.get_tokenizer()
+        sot_token = tokenizer.encoder["<|startoftext|>"]
+        eot_token = tokenizer.encoder["<|endoftext|>"]
+
+        text_input = torch.zeros(len(texts), context_length, dtype=torch.int)
+        for i, (_, tokens) in enumerate(self.truncate_for_clip(texts, max_tokens=context_length - 2)):
+            row = [sot_token] + tokens + [eot_token]
+            text_input[i, :len(row)] = torch.tensor(row)
+
+        return text_input
     
     def __get_clip_embedding__(self, text: str | None = None, image_path: str | None = None, img_weight: float = 0.4, txt_weight: float = 0.6):
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        model, preprocess = clip.load("ViT-B/32", device=device)
-        model.eval()
-
-        image_vec = None
-        text_vec = None
+        return self.get_clip_embeddings([(text, image_path)], batch_size=1, img_weight=img_weight, txt_weight=txt_weight)[0]
 
-        if image_path:
-            image = Image.open(image_path)
-            image_tensor = preprocess(image)
+    def get_clip_embeddings(self, items: List[Tuple[str | None, str | None]], batch_size: int = CLIP_BATCH_SIZE, img_weight: float = 0.4, txt_weight: float = 0.6) -> List[List[float]]:
+        if any(not text and not image_path for text, image_path in items):
+            raise ValueError("Provide at least one of image_path or text.")
 
-            image_tensor = cast(Tensor, image_tensor)
+        device = clip_registry.device
+        model, preprocess = clip_registry.load()
+        vectors: List[List[float]] = []
 
-            image_input = image_tensor.unsqueeze(0).to(device)
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            image_rows = [i for i, (_, image_path) in enumerate(batch) if image_path]
+            text_rows = [i for i, (text, _) in enumerate(batch) if text]
+            image_vecs: Dict[int, Tensor] = {}
+            text_vecs: Dict[int, Tensor] = {}
 
             with torch.no_grad():
-                image_vec = model.encode_image(image_input).squeeze(0)
-                image_vec = F.normalize(image_vec, dim=0)
+                if image_rows:
+                    image_tensors = []
+                    for i in image_rows:
+                        with Image.open(cast(str, batch[i][1])) as image:
+                            image_tensors.append(cast(Tensor, preprocess(image)))
+
+                    image_input = torch.stack(image_tensors).to(device)
+                    encoded = F.normalize(model.encode_image(image_input), dim=-1)
+                    image_vecs = dict(zip(image_rows, encoded))
+
+                if text_rows:
+                    text_input = self.__clip_text_input__([cast(str, batch[i][0]) for i in text_rows]).to(device)
+                    encoded = F.normalize(model.encode_text(text_input), dim=-1)
+                    text_vecs = dict(zip(text_rows, encoded))
+
+            for i in range(len(batch)):
+                image_vec = image_vecs.get(i)
+                text_vec = text_vecs.get(i)
+
+                if image_vec is not None and text_vec is not None:
+                    vectors.append((img_weight * image_vec + txt_weight * text_vec).tolist())
+                elif image_vec is not None:
+                    vectors.append(image_vec.tolist())
+                else:
+                    vectors.append(cast(Tensor, text_vec).tolist())
 
-        if text:
-            safe_text = self.__truncate_for_clip__(text)
-            text_token = clip.tokenize(safe_text).to(device)
-            with torch.no_grad():
-                text_vec = model.encode_text(text_token).squeeze(0)
-                text_vec = F.normalize(text_vec, dim=0)
-
-        if image_vec is not None and text_vec is not None:
-            combined = (img_weight * image_vec + txt_weight * text_vec).tolist()
-            return combined
-        elif image_vec is not None:
-            return image_vec.tolist()
-        elif text_vec is not None:
-            return text_vec.tolist()
-        else:
-            raise ValueError("Provide at least one of image_path or text.")
+        return vectors
         
-    def embed_and_upsert_images(self, llm: LLM, db: DBHandler, images: List[Dict], namespace="images"):        
+    def describe_image(self, llm: LLM, image: Dict) -> str | None:
+        return llm.generate_image_description(f"Context Before: {image["context_before"]}\n\nContext After: {image["context_after"]}", image["image_path"])
+
+    def describe_images(self, llm: LLM, images: List[Dict], max_concurrency: int = IMAGE_DESCRIPTION_CONCURRENCY, progress: Callable[[int, int], None] | None = None) -> List[str | None]:
+        descriptions: List[str | None] = [None] * len(images)
+        done = 0
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="image-desc") as executor:
+            futures = {executor.submit(self.describe_image, llm, image): i for i, image in enumerate(images)}
+
+            for future in as_completed(futures):
+                # Results are written back by position so they stay aligned with the extraction metadata
+                descriptions[futures[future]] = future.result()
+                done += 1
+                if progress:
+                    progress(done, len(images))
+
+        return descriptions
+
+    def embed_and_upsert_images(self, llm: LLM, db: DBHandler, images: List[Dict], document_id: int, namespace="images", progress: Callable[[int, int], None] | None = None) -> List[Tuple[str, str | None]]:        
+        log.log_event("SYSTEM", "Embedding and Upserting Images --- Generating Image Descriptions")
+        descriptions = self.describe_images(llm=llm, images=images, progress=progress)
+
+        results = self.upsert_image_batch(images=images, descriptions=descriptions, document_id=document_id, namespace=namespace)
+        log.log_event("SYSTEM", "Embedding and Upserting Images --- Upserting Images to the vector store SUCCESSFUL")
+        return results
+
+    def upsert_image_batch(self, images: List[Dict], descriptions: List[str | None], document_id: int, namespace="images") -> List[Tuple[str, str | None]]:
         records = []
 
-        log.log_event("SYSTEM", "Embedding and Upserting Images --- CLIP Embedding Images")
-        for image in images:
-            image_desc = llm.generate_image_description(f"Context Before: {image["context_before"]}\n\nContext After: {image["context_after"]}", image["image_path"])
-            vector = (self.__get_clip_embedding__(text=image_desc, image_path=image["image_path"]))
-            
+        vectors = self.get_clip_embeddings([(image_desc, image["image_path"]) for image, image_desc in zip(images, descriptions)])
+
+        for image, image_desc, vector in zip(images, descriptions, vectors):
             records.append({
-                "_id": f"{namespace}-chunk-{uuid.uuid4().hex}",
+                "_id": image_vector_id(namespace, document_id, image["page_number"], image["image_number"]),
                 "values": vector,
                 "description": image_desc,
                 "source": os.path.basename(image["image_path"]),
                 "page_no": image["page_number"],
                 "image_no": image["image_number"],
+                "document_id": document_id,
             })
             # print(type(chunk))
 
-        log.log_event("SYSTEM", "Embedding and Upserting Images --- Upserting Images to PineconeDB")
-        self.index_images.upsert(
-            namespace=namespace,
-            vectors=[
-                (
-                    record["_id"],      
-                    record["values"], 
-                    {
-                        "description": record["description"],
-                        "source": record["source"],
-                        "page_no": record["page_no"],
-                        "image_no": record["image_no"]
-                    }               
-                )
-                for record in records
-            ]
-        )
-        log.log_event("SYSTEM", "Embedding and Upserting Images --- Upserting Images to PineconeDB SUCCESSFUL")
-
-    def upsert_document(self, document_path, namespace="documents"):
-        document = fitz.open(document_path)
-
-        cleaned_text = ""
-        records = []
-
-        for page_num in range(len(document)):
-            # page = document[page_num]
-            page = cast(Any, document[page_num])
-            blocks = page.get_text("blocks") 
-            blocks.sort(key=lambda b: (b[1], b[0]))  
-
-            text = " ".join([b[4].strip() for b in blocks if b[4].strip()])
-            cleaned_text += self.__clean_text__(text)
-
-        text_chunks = self.__tokenize__(cleaned_text)
-
-        for chunk in text_chunks:
-            records.append({
-                "_id": f"{namespace}-chunk-{uuid.uuid4().hex}",
-                "text": chunk,
-                "source": os.path.basename(document_path),
-            })
-
-        log.log_event("SYSTEM", "Upsert Document --- Upserting Records to PineconeDB")
+        self.image_store.upsert(namespace=namespace, records=records)
+        self.query_cache.invalidate()
+        return [(record["_id"], record["description"]) for record in records]
+
+    def upsert_document(self, document_path, document_id: int, namespace="documents", parsed: ParsedDocument | None = None, pages: Set[int] | None = None) -> Dict[int, List[str]]:
+        if parsed is None:
+            parsed = ParsedDocument.from_path(document_path)
+
+        page_vector_ids: Dict[int, List[str]] = {page.number: [] for page in parsed.pages if pages is None or page.number in pages}
+        records = self.iter_text_records((page for page in parsed.pages if page.number in page_vector_ids), source=parsed.basename, document_id=document_id, namespace=namespace)
+
+        log.log_event("SYSTEM", "Upsert Document --- Upserting Records to the vector store")
+        for batch in self.upsert_text_records(records, namespace=namespace):
+            for record in batch:
+                page_vector_ids[record["page_no"]].append(record["_id"])
+
+        log.log_event("SYSTEM", "Upsert Document --- Upserting Records to the vector store SUCCESSFUL")
+        return page_vector_ids
+
+    def iter_text_records(self, pages: Iterable[ParsedPage], source: str, document_id: int, namespace="documents") -> Iterator[Dict]:
+        # Chunks never cross page boundaries so a single page can be re-ingested on its own
+        for chunk in self.chunker.chunk_pages((page.number, page.text) for page in pages):
+            yield {
+                "_id": text_vector_id(namespace, document_id, chunk.page, chunk.ordinal),
+                "text": chunk.text,
+                "source": source,
+                "document_id": document_id,
+                "page_no": chunk.page,
+                "chunk_no": chunk.ordinal,
+                "token_start": chunk.token_start,
+                "token_end": chunk.token_end,
+            }
+
+    def upsert_text_records(self, records: Iterable[Dict], namespace="documents", batch_size: int = 96) -> Iterator[List[Dict]]:
+        # Yields each batch once it is stored so callers can track ids without holding every record
+        for batch in batched(records, batch_size):
+            self.text_store.upsert(namespace=namespace, records=batch)
+            self.lexical_index.upsert(namespace=namespace, records=batch)
+            self.query_cache.invalidate()
+            yield batch
+
+    def delete_text_vectors(self, ids: List[str], namespace="documents") -> None:
+        log.log_event("SYSTEM", f"Deleting {len(ids)} text vectors from the vector store")
+        self.text_store.delete(namespace=namespace, ids=ids)
+        self.lexical_index.delete(namespace=namespace, ids=ids)
+        self.query_cache.invalidate()
+
+    def delete_image_vectors(self, ids: List[str], namespace="images") -> None:
+        log.log_event("SYSTEM", f"Deleting {len(ids)} image vectors from the vector store")
+        self.image_store.delete(namespace=namespace, ids=ids)
+        self.query_cache.invalidate()
+
+    def __list_vector_ids__(self, store: VectorStore, prefix: str, namespace: str) -> List[str]:
+        try:
+            return store.list_ids(namespace=namespace, prefix=prefix)
+        except Exception as excp:
+            # Listing by prefix is only available on serverless indexes, the stored ids are still deleted
+            log.log_event("SYSTEM", f"Listing vectors with prefix {prefix} failed. {excp}")
+            return []
+
+    def delete_document_vectors(self, document_id: int, text_ids: List[str], image_ids: List[str], text_namespace="documents", image_namespace="images") -> None:
+        # Listing by prefix also catches vectors left behind by an ingestion that failed before its ids were stored
+        text_ids = sorted(set(text_ids) | set(self.__list_vector_ids__(self.text_store, document_vector_prefix(text_namespace, document_id), text_namespace)))
+        image_ids = sorted({vector_id for vector_id in image_ids if image_vector_owner(image_namespace, vector_id) in (None, document_id)} | set(self.__list_vector_ids__(self.image_store, document_vector_prefix(image_namespace, document_id), image_namespace)))
+
+        if text_ids:
+            self.delete_text_vectors(text_ids, namespace=text_namespace)
+        if image_ids:
+            self.delete_image_vectors(image_ids, namespace=image_namespace)
+
+    def iter_unique_images(self, pages: Iterable[ParsedPage], include: Callable[[ParsedPage, ParsedImage], bool] | None = None, fingerprints: List[Dict] | None = None, max_distance: int = IMAGE_DEDUP_DISTANCE, report: Dict[str, int] | None = None, references: Dict[Tuple[int, int], Dict] | None = None) -> Iterator[Tuple[ParsedPage, ParsedImage]]:
+        known = [(int(fingerprint["perceptual_hash"], 16), fingerprint) for fingerprint in fingerprints or []]
+        canonical: List[Tuple[int, Tuple[int, int]]] = []
+        # What each seen xref resolved to, so later occurrences of the same embedded image share it
+        seen_xrefs: Dict[int, Dict] = {}
+        report = report if report is not None else {}
+        references = references if references is not None else {}
+        report.update({"images": 0, "unique": 0, "xref_duplicates": 0, "near_duplicates": 0, "cross_document_duplicates": 0})
+
+        for page in pages:
+            for image in page.images:
+                key = (page.number, image.index + 1)
+                image_hash = int(image.perceptual_hash, 16)
+
+                # Skipped images already have a vector, so they still count as canonical for the ones that follow
+                if include is not None and not include(page, image):
+                    canonical.append((image_hash, key))
+                    seen_xrefs.setdefault(image.xref, {"key": key})
+                    continue
 
-        # 🔹 Batch the records in chunks of 96
-        batch_size = 96
-        for i in range(0, len(records), batch_size):
-            batch = records[i:i + batch_size]
-            self.index.upsert_records(namespace=namespace, records=batch)
+                # Duplicates within the document name the canonical position, whose vector is only known once it
+                # is upserted, cross-document ones carry the matched image's vector and description
+                report["images"] += 1
+                nearest = min(canonical, key=lambda item: (image_hash ^ item[0]).bit_count(), default=None)
+                if image.xref in seen_xrefs:
+                    report["xref_duplicates"] += 1
+                    references[key] = dict(seen_xrefs[image.xref])
+                elif nearest is not None and (image_hash ^ nearest[0]).bit_count() <= max_distance:
+                    report["near_duplicates"] += 1
+                    references[key] = {"key": nearest[1]}
+                else:
+                    match = min(known, key=lambda item: (image_hash ^ item[0]).bit_count(), default=None)
+                    if match is not None and (image_hash ^ match[0]).bit_count() <= max_distance:
+                        report["cross_document_duplicates"] += 1
+                        references[key] = {"perceptual_hash": image.perceptual_hash, "description": match[1]["description"], "vector_id": match[1]["vector_id"]}
+                    else:
+                        report["unique"] += 1
+                        canonical.append((image_hash, key))
+                        seen_xrefs[image.xref] = {"key": key}
+                        yield page, image
+                        continue
+                seen_xrefs.setdefault(image.xref, references[key])
+
+    def deduplicate_images(self, parsed: ParsedDocument, include: Set[Tuple[int, int]] | None = None, fingerprints: List[Dict] | None = None, max_distance: int = IMAGE_DEDUP_DISTANCE) -> Tuple[Set[Tuple[int, int]], Dict[str, int]]:
+        report: Dict[str, int] = {}
+        unique = {
+            (page.number, image.index + 1)
+            for page, image in self.iter_unique_images(parsed.pages, include=(lambda page, image: (page.number, image.index + 1) in include) if include is not None else None, fingerprints=fingerprints, max_distance=max_distance, report=report)
+        }
+        log.log_event("SYSTEM", f"Deduplicate Images --- {report['images'] - report['unique']} of {report['images']} images reuse an existing description and vector")
+        return unique, report
+
+    def delete_extracted_images(self, document_name: str, output_dir: str = "./images") -> int:
+        # Matches the file names written by extract_image
+        pattern = os.path.join(glob.escape(output_dir), f"{glob.escape(document_name)}_pg*_img*.png")
+        removed = 0
+        for img_path in glob.glob(pattern):
+            try:
+                os.remove(img_path)
+                removed += 1
+            except OSError as e:
+                log.log_event("SYSTEM", f"[DOCUMENT] Failed to remove extracted image {img_path} - {e}")
+        return removed
+
+    def extract_images_with_context(self, document_path: str, output_dir: str = "./images", parsed: ParsedDocument | None = None, include: Set[Tuple[int, int]] | None = None) -> List[Dict]:
+        os.makedirs(output_dir, exist_ok=True)
+        if parsed is None:
+            parsed = ParsedDocument.from_path(document_path)
 
-        log.log_event("SYSTEM", "Upsert Document --- Upserting Records to PineconeDB SUCCESSFUL")
+        return [
+            self.extract_image(parsed.name, page, image, output_dir=output_dir)
+            for page, image in parsed.iter_images()
+            if include is None or (page.number, image.index + 1) in include
+        ]
 
-    def extract_images_with_context(self, document_path: str, output_dir: str = "./images") -> List[Dict]:
+    def extract_image(self, document_name: str, page: ParsedPage, image: ParsedImage, output_dir: str = "./images") -> Dict:
         os.makedirs(output_dir, exist_ok=True)
-        doc_name = Path(document_path).stem
 
-        pdf_doc = fitz.open(document_path)
-        extracted_data = []
+        # Save the image
+        img_filename = f"{document_name}_pg{page.number}_img{image.index + 1}.png"
+        img_path = os.path.join(output_dir, img_filename)
 
-        for page_num in range(len(pdf_doc)):
-            # page = pdf_doc[page_num]
-            page = cast(Any, pdf_doc[page_num])
-            page_text = page.get_text()
-            image_list = page.get_images()
+        with open(img_path, "wb") as img_file:
+            img_file.write(image.data)
 
-            for img_index, img in enumerate(image_list):
-                xref = img[0]
-                pix = fitz.Pixmap(pdf_doc, xref)
+        blob.upload_file(service=blob.authenticate(), file_path=img_path, folder_name="DocumentImages")
 
-                # Skip very tiny images (like dots or background)
-                if pix.width < 10 or pix.height < 10:
-                    pix = None
-                    continue
+        # Get context around the image
+        if image.bbox is not None:
+            context_before, context_after = self.__get_text_context_around_image__(
+                page.text_blocks, image.bbox, context_chars=500
+            )
+        else:
+            context_before, context_after = self.__get_page_text_context__(
+                page.raw_text, page.image_count, image.index, context_chars=500
+            )
+
+        # Store extraction info
+        return {
+            "image_filename": img_filename,
+            "image_path": img_path,
+            "page_number": page.number,
+            "image_number": image.index + 1,
+            "context_before": context_before,
+            "context_after": context_after,
+            "image_dimensions": (image.width, image.height),
+            "content_hash": image.content_hash,
+            "perceptual_hash": image.perceptual_hash,
+        }
 
-                # ✅ Convert to RGB if alpha channel exists or it's not grayscale/RGB
-                if pix.alpha or pix.colorspace not in (fitz.csGRAY, fitz.csRGB):
-                    pix_converted = fitz.Pixmap(fitz.csRGB, pix)
-                    img_data = pix_converted.tobytes("png")
-                    pix_converted = None
-                else:
-                    img_data = pix.tobytes("png")
-
-                # Save the image
-                img_filename = f"{doc_name}_pg{page_num + 1}_img{img_index + 1}.png"
-                img_path = os.path.join(output_dir, img_filename)
-                blob.upload_file(service=blob.authenticate(), file_path=img_path, folder_name="DocumentImages")
-
-                with open(img_path, "wb") as img_file:
-                    img_file.write(img_data)
-
-                # Get context around the image
-                try:
-                    img_rect = page.get_image_bbox(img)
-                    context_before, context_after = self.__get_text_context_around_image__(
-                        page, img_rect, page_text, context_chars=500
-                    )
-                except:
-                    context_before, context_after = self.__get_page_text_context__(
-                        page_text, len(image_list), img_index, context_chars=500
-                    )
-
-                # Store extraction info
-                extraction_info = {
-                    "image_filename": img_filename,
-                    "image_path": img_path,
-                    "page_number": page_num + 1,
-                    "image_number": img_index + 1,
-                    "context_before": context_before,
-                    "context_after": context_after,
-                    "image_dimensions": (pix.width, pix.height),
-                }
-                extracted_data.append(extraction_info)
-
-                # Cleanup
-                pix = None
-
-        pdf_doc.close()
-        return extracted_data
-
-    def create_document_summary(self, llm: LLM, document_path) -> str | None:
-        document = fitz.open(document_path)
-        cleaned_text = ""
-
-        for page_num in range(len(document)):
-            # page = document[page_num]
-            page = cast(Any, document[page_num])
-            blocks = page.get_text("blocks") 
-            blocks.sort(key=lambda b: (b[1], b[0]))  
-
-            text = " ".join([b[4].strip() for b in blocks if b[4].strip()])
-            cleaned_text += self.__clean_text__(text) 
-
-        summary = llm.generate_document_summary(text=cleaned_text)
-        return summary    
+    def __pack_by_tokens__(self, texts: List[str], max_tokens: int) -> List[List[str]]:
+        groups: List[List[str]] = []
+        current: List[str] = []
+        current_tokens = 0
+
+        for text in texts:
+            token_count = count_tokens(text)
+            if current and current_tokens + token_count > max_tokens:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += token_count
+
+        if current:
+            groups.append(current)
+        return groups
+
+    def __split_sections__(self, page_texts: List[str], max_tokens: int, average_pages: int = SUMMARY_SECTION_PAGES) -> List[str]:
+        groups: List[List[str]] = [[]]
+
+        # A section ends after any page whose own hash picks it as a split point, so boundaries depend only on
+        # page content and an edit changes its own section (or merges it with a neighbour) instead of every later one
+        for page_text in page_texts:
+            if not page_text:
+                continue
+            groups[-1].extend(chunk_text for _, _, chunk_text in Chunker(max_tokens=max_tokens, overlap=0).chunk_text(page_text))
+            if int(hashlib.sha256(page_text.encode("utf-8")).hexdigest()[:8], 16) % max(1, average_pages) == 0:
+                groups.append([])
+
+        # Groups over the budget are cut by tokens, which only moves boundaries inside that group
+        return [" ".join(section) for group in groups if group for section in self.__pack_by_tokens__(group, max_tokens)]
+
+    def __summarize_sections__(self, llm: LLM, sections: List[str], db: DBHandler | None) -> List[str]:
+        hashes = [hashlib.sha256(f"{llm.model_s}\n{section}".encode("utf-8")).hexdigest() for section in sections]
+        cached = (db.get_section_summaries(content_hashes=hashes) or {}) if db else {}
+        missing = [i for i, content_hash in enumerate(hashes) if content_hash not in cached]
+
+        with ThreadPoolExecutor(max_workers=max(1, SUMMARY_CONCURRENCY), thread_name_prefix="summary") as executor:
+            results = list(executor.map(llm.generate_section_summary, [sections[i] for i in missing]))
+
+        fresh = {hashes[i]: summary for i, summary in zip(missing, results) if summary}
+        if db and fresh:
+            db.save_section_summaries(summaries=fresh)
+
+        log.log_event("SYSTEM", f"Document Summary --- {len(sections)} sections, {len(sections) - len(missing)} reused from cache")
+        # A summary missing a section would silently describe only part of the document, so the job fails instead.
+        # The sections that did succeed are cached, a retry only pays for the rest
+        failed = len(missing) - len(fresh)
+        if failed:
+            raise RuntimeError(f"Failed to summarize {failed} of {len(sections)} sections")
+
+        summaries = {**cached, **fresh}
+        return [summaries[content_hash] for content_hash in hashes]
+
+    def __merge_summaries__(self, llm: LLM, summaries: List[str]) -> str:
+        summary = llm.merge_section_summaries(summaries)
+        if not summary:
+            raise RuntimeError(f"Failed to merge {len(summaries)} section summaries")
+        return summary
+
+    def create_document_summary(self, llm: LLM, document_path, parsed: ParsedDocument | None = None, db: DBHandler | None = None, page_texts: List[str] | None = None) -> str | None:
+        if page_texts is None:
+            if parsed is None:
+                parsed = ParsedDocument.from_path(document_path)
+            page_texts = [page.text for page in parsed.pages]
+
+        sections = self.__split_sections__(page_texts, SUMMARY_SECTION_TOKENS)
+        if len(sections) <= 1:
+            return llm.generate_document_summary(text="\n".join(page_text for page_text in page_texts if page_text))
+
+        summaries = self.__summarize_sections__(llm, sections, db)
+
+        # Merge hierarchically until the remaining summaries fit into a single call
+        while len(summaries) > 1:
+            groups = self.__pack_by_tokens__(summaries, SUMMARY_SECTION_TOKENS)
+            if len(groups) == 1:
+                return self.__merge_summaries__(llm, summaries)
+            # Summaries that each fill the budget cannot be packed, merging them in pairs still halves the count
+            # every round while keeping each call at two summaries
+            if len(groups) == len(summaries):
+                groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+
+            with ThreadPoolExecutor(max_workers=max(1, SUMMARY_CONCURRENCY), thread_name_prefix="summary") as executor:
+                summaries = list(executor.map(lambda group: self.__merge_summaries__(llm, group), groups))
+
+        return summaries[0] if summaries else None
 
     def query_images_with_text(self, query: str, namespace="images", top_k=5):
-        device = "cuda" if torch.cuda.is_available() else "cpu"
+        return self.query_cache.get_or_compute(("images", normalize_query(query), namespace, top_k), lambda: self.__query_images_with_text__(query, namespace, top_k))
+
+    def __query_images_with_text__(self, query: str, namespace: str, top_k: int):
         query_vector = self.__get_clip_embedding__(text=query)
 
-        log.log_event("SYSTEM", "Querying Images in PineconeDB")
-        results = self.index_images.query(
-            namespace=namespace,
-            vector=query_vector,
-            top_k=top_k,
-            include_metadata=True
-        )
-        results = cast(Dict[str, Any], results)
-        return results["matches"][0]["metadata"]["source"]
-
-    def query_text(self, user_query, namespace="documents", top_k=3):
-        log.log_event("SYSTEM", "Querying Text in PineconeDB")
-        
-        query_dict = {
-            "inputs": {
-                "text": user_query
-            },
-            "top_k": top_k
-        }
-        typed_query = cast(Dict[str, Any], query_dict)
-        results = self.index.search(
-            namespace=namespace,
-            query=cast(Any, typed_query),
-            fields=["text"]
-        )
-
-        texts = [hit["fields"]["text"] for hit in results["result"]["hits"]]
-        return "\n".join([f"Answer {i+1}: {item} \n" for i, item in enumerate(texts)])
\ No newline at end of file
+        log.log_event("SYSTEM", "Querying Images in the vector store")
+        matches = self.image_store.search(namespace=namespace, top_k=top_k, vector=query_vector, fields=["source"])
+        return matches[0]["fields"]["source"]
+
+    def __fetch_chunks__(self, namespace: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        # The lexical index holds every chunk's fields locally, the vector store is only asked for what it lacks
+        chunks = self.lexical_index.get(namespace=namespace, ids=ids)
+        missing = [chunk_id for chunk_id in ids if chunk_id not in chunks]
+        if missing:
+            try:
+                chunks.update(self.text_store.fetch(namespace=namespace, ids=missing))
+            except Exception as excp:
+                log.log_event("SYSTEM", f"Fetching neighbour chunks failed. {excp}")
+        return chunks
+
+    def __expand_neighbours__(self, namespace: str, passages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        neighbours: Dict[str, float] = {}
+        for passage in passages:
+            fields = passage["fields"]
+            if fields.get("document_id") is None or fields.get("chunk_no") is None:
+                continue
+            # Pinecone hands numeric metadata back as floats
+            for chunk_no in (int(fields["chunk_no"]) - 1, int(fields["chunk_end"]) + 1):
+                if chunk_no >= 0:
+                    neighbours[text_vector_id(namespace, int(fields["document_id"]), int(fields["page_no"]), chunk_no)] = passage["score"]
+
+        if not neighbours:
+            return []
+
+        fetched = self.__fetch_chunks__(namespace, list(neighbours))
+        return [{"id": chunk_id, "score": neighbours[chunk_id], "fields": {key: value for key, value in fields.items() if key in PASSAGE_FIELDS}} for chunk_id, fields in fetched.items()]
+
+    def retrieve_passages(self, user_query: str, namespace="documents", top_k: int = RETRIEVAL_PASSAGES) -> List[Dict[str, Any]]:
+        # Oversample, rerank against the query, then merge consecutive chunks so an answer that spans a
+        # chunk boundary comes back as one passage instead of overlapping fragments
+        hits = self.search_text(user_query=user_query, namespace=namespace, top_k=max(top_k, RERANK_CANDIDATES), fields=PASSAGE_FIELDS)
+        ranked = rerank(user_query, hits, CrossScorer(idfs=lambda terms: self.lexical_index.idfs(namespace, terms)))
+
+        passages: List[Dict[str, Any]] = []
+        seen_texts: Set[str] = set()
+        for passage in merge_passages(ranked):
+            text_key = " ".join(passage["fields"].get("text", "").split()).lower()
+            if text_key in seen_texts:
+                continue
+            seen_texts.add(text_key)
+            passages.append(passage)
+            if len(passages) == top_k:
+                break
+
+        if NEIGHBOUR_EXPANSION and passages:
+            selected = {chunk_id for passage in passages for chunk_id in passage["ids"]}
+            members = [hit for hit in ranked if hit["id"] in selected]
+            passages = merge_passages(members + self.__expand_neighbours__(namespace, passages))[:top_k]
+
+        return passages
+
+    def query_passages(self, user_query: str, namespace="documents", top_k: int = RETRIEVAL_PASSAGES) -> List[Dict[str, Any]]:
+        # Repeated questions are served from memory until the corpus changes or the entry expires
+        return self.query_cache.get_or_compute(("passages", normalize_query(user_query), namespace, top_k), lambda: self.retrieve_passages(user_query, namespace, top_k))
+
+    def query_text(self, user_query, namespace="documents", top_k=RETRIEVAL_PASSAGES):
+        log.log_event("SYSTEM", "Querying Text in the vector store")
+        passages = self.query_passages(user_query=user_query, namespace=namespace, top_k=top_k)
+
+        answers = []
+        for i, passage in enumerate(passages):
+            fields = passage["fields"]
+            citation = f" ({fields['source']}, page {fields['page_no']})" if fields.get("page_no") else ""
+            answers.append(f"Answer {i+1}{citation}: {fields['text']} \n")
+        return "\n".join(answers)
+
+    def search_text(self, user_query: str, namespace="documents", top_k=3, fields: List[str] | None = None) -> List[Dict[str, Any]]:
+        fields = fields or ["text", "source", "page_no"]
+        if not HYBRID_SEARCH:
+            return self.text_store.search(namespace=namespace, top_k=top_k, text=user_query, fields=fields)
+
+        # Dense and BM25 candidates are fetched side by side and fused by rank, exact terms such as
+        # clause numbers and allowance codes surface even when the embedding ranks them low
+        candidates = max(top_k, HYBRID_CANDIDATES)
+        dense = self.search_executor.submit(self.text_store.search, namespace=namespace, top_k=candidates, text=user_query, fields=fields)
+        lexical = self.lexical_index.search(namespace=namespace, top_k=candidates, text=user_query, fields=fields)
+
+        return reciprocal_rank_fusion([dense.result(), lexical], k=RRF_K)[:top_k]
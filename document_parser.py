@@ -0,0 +1,195 @@
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import cast, Any, List, Tuple, Iterator
+from dotenv import load_dotenv
+from logger import Logger
+from PIL import Image as PILImage
+from collections import deque
+from pathlib import Path
+import multiprocessing
+import threading
+import hashlib
+import io
+import fitz
+import os
+import re
+
+load_dotenv()
+log = Logger()
+
+PDF_PARSE_WORKERS = int(os.environ.get("PDF_PARSE_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARSE_MIN_PAGES = int(os.environ.get("PDF_PARSE_MIN_PAGES", "32"))
+
+parse_pool: ProcessPoolExecutor | None = None
+parse_pool_lock = threading.Lock()
+
+def __get_parse_pool__(workers: int) -> ProcessPoolExecutor:
+    global parse_pool
+
+    # Spawned (not forked) workers so the pool is safe to start from a threaded server process
+    with parse_pool_lock:
+        if parse_pool is None:
+            parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return parse_pool
+
+class ParsedImage:
+    def __init__(self, xref: int, index: int, bbox: Tuple[float, float, float, float] | None, width: int, height: int, data: bytes) -> None:
+        self.xref = xref
+        self.index = index
+        self.bbox = bbox
+        self.width = width
+        self.height = height
+        self.data = data
+        self.content_hash = hashlib.sha256(data).hexdigest()
+        self.perceptual_hash = self.__perceptual_hash__(data)
+
+    @staticmethod
+    def __perceptual_hash__(data: bytes, hash_size: int = 8) -> str:
+        # Difference hash: one bit per horizontally adjacent pixel pair of a downscaled grayscale copy
+        with PILImage.open(io.BytesIO(data)) as image:
+            pixels = list(image.convert("L").resize((hash_size + 1, hash_size), PILImage.Resampling.LANCZOS).getdata())
+
+        bits = 0
+        for row in range(hash_size):
+            for col in range(hash_size):
+                offset = row * (hash_size + 1) + col
+                bits = (bits << 1) | (pixels[offset] > pixels[offset + 1])
+        return f"{bits:0{hash_size * hash_size // 4}x}"
+
+class ParsedPage:
+    def __init__(self, number: int, text: str, raw_text: str, text_blocks: List[Tuple[Tuple[float, float, float, float], str]], images: List[ParsedImage], image_count: int) -> None:
+        self.number = number
+        self.text = text
+        self.raw_text = raw_text
+        self.text_blocks = text_blocks
+        self.images = images
+        self.image_count = image_count
+        self.content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class ParsedDocument:
+    def __init__(self, path: str, pages: List[ParsedPage]) -> None:
+        self.path = path
+        self.name = Path(path).stem
+        self.basename = os.path.basename(path)
+        self.pages = pages
+
+    @property
+    def text(self) -> str:
+        return "\n".join(page.text for page in self.pages if page.text)
+
+    def iter_images(self) -> Iterator[Tuple[ParsedPage, ParsedImage]]:
+        for page in self.pages:
+            for image in page.images:
+                yield page, image
+
+    @staticmethod
+    def __clean_text__(text: str) -> str:
+        text = re.sub(r'\s+', ' ', text)
+        return text.strip()
+
+    @classmethod
+    def __parse_images__(cls, pdf_doc, page, image_list) -> List[ParsedImage]:
+        images = []
+
+        for img_index, img in enumerate(image_list):
+            xref = img[0]
+            pix = fitz.Pixmap(pdf_doc, xref)
+
+            # Skip very tiny images (like dots or background)
+            if pix.width < 10 or pix.height < 10:
+                pix = None
+                continue
+
+            # Convert to RGB if alpha channel exists or it's not grayscale/RGB
+            if pix.alpha or pix.colorspace not in (fitz.csGRAY, fitz.csRGB):
+                pix_converted = fitz.Pixmap(fitz.csRGB, pix)
+                img_data = pix_converted.tobytes("png")
+                pix_converted = None
+            else:
+                img_data = pix.tobytes("png")
+
+            try:
+                rect = page.get_image_bbox(img)
+                bbox = (rect.x0, rect.y0, rect.x1, rect.y1)
+            except Exception:
+                bbox = None
+
+            images.append(ParsedImage(xref=xref, index=img_index, bbox=bbox, width=pix.width, height=pix.height, data=img_data))
+            pix = None
+
+        return images
+
+    @classmethod
+    def __parse_page__(cls, pdf_doc, page_num: int) -> ParsedPage:
+        page = cast(Any, pdf_doc[page_num])
+
+        blocks = page.get_text("blocks")
+        blocks.sort(key=lambda b: (b[1], b[0]))
+        text = cls.__clean_text__(" ".join([b[4].strip() for b in blocks if b[4].strip()]))
+
+        image_list = page.get_images()
+        raw_text = ""
+        text_blocks: List[Tuple[Tuple[float, float, float, float], str]] = []
+        images: List[ParsedImage] = []
+
+        # Only pages with images need the raw text and layout dict for image context
+        if image_list:
+            raw_text = page.get_text()
+            for block in page.get_text("dict")["blocks"]:
+                if "lines" not in block:
+                    continue
+                block_text = " ".join(span["text"] for line in block["lines"] for span in line["spans"])
+                text_blocks.append((tuple(block["bbox"]), block_text.strip()))
+            images = cls.__parse_images__(pdf_doc, page, image_list)
+
+        return ParsedPage(
+            number=page_num + 1,
+            text=text,
+            raw_text=raw_text,
+            text_blocks=text_blocks,
+            images=images,
+            image_count=len(image_list),
+        )
+
+    @classmethod
+    def parse_range(cls, document_path: str, start: int, end: int) -> List[ParsedPage]:
+        pdf_doc = fitz.open(document_path)
+
+        try:
+            return [cls.__parse_page__(pdf_doc, page_num) for page_num in range(start, min(end, len(pdf_doc)))]
+        finally:
+            pdf_doc.close()
+
+    @classmethod
+    def iter_pages(cls, document_path: str, workers: int = PDF_PARSE_WORKERS) -> Iterator[ParsedPage]:
+        with fitz.open(document_path) as pdf_doc:
+            page_count = len(pdf_doc)
+
+        if workers <= 1 or page_count < PDF_PARSE_MIN_PAGES:
+            pdf_doc = fitz.open(document_path)
+            try:
+                for page_num in range(page_count):
+                    yield cls.__parse_page__(pdf_doc, page_num)
+            finally:
+                pdf_doc.close()
+            return
+
+        # Several small ranges per worker keep the pool balanced when some pages are image heavy,
+        # and only a bounded number are in flight so parsed pages never pile up ahead of the consumer
+        range_size = max(1, -(-page_count // (workers * 4)))
+        pool = __get_parse_pool__(workers)
+        pending: deque[Future] = deque()
+
+        for start in range(0, page_count, range_size):
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+            pending.append(pool.submit(cls.parse_range, document_path, start, start + range_size))
+
+        while pending:
+            yield from pending.popleft().result()
+
+    @classmethod
+    def from_path(cls, document_path: str, workers: int = PDF_PARSE_WORKERS) -> "ParsedDocument":
+        pages = list(cls.iter_pages(document_path, workers=workers))
+
+        log.log_event("SYSTEM", f"[PARSER] Parsed {len(pages)} pages from {os.path.basename(document_path)}")
+        return cls(path=document_path, pages=pages)
@@ -0,0 +1,481 @@
+from concurrent.futures import ThreadPoolExecutor
+from document_handling import Document, IMAGE_DESCRIPTION_CONCURRENCY, image_vector_id, image_vector_owner
+from pipeline import StreamPipeline, batched, parallel_map
+from document_parser import ParsedDocument, ParsedPage, ParsedImage
+from clip_registry import CLIP_BATCH_SIZE
+from datetime import datetime, timezone
+from typing import cast, Any, Callable, Dict, Iterator, List, Set, Tuple
+from contextlib import contextmanager
+from database import DBHandler
+from dotenv import load_dotenv
+from logger import Logger
+from blob import Blob
+from llm import LLM
+import threading
+import hashlib
+import time
+import uuid
+import os
+
+load_dotenv()
+log = Logger()
+
+INGESTION_MAX_CONCURRENCY = int(os.environ.get("INGESTION_MAX_CONCURRENCY", "2"))
+INGESTION_JOB_RETENTION = int(os.environ.get("INGESTION_JOB_RETENTION", "100"))
+
+class IngestionStage:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.status = "running"
+        self.started_at = datetime.now(timezone.utc)
+        self.finished_at: datetime | None = None
+        self.duration_s: float | None = None
+        self.completed = 0
+        self.total: int | None = None
+        self.error: str | None = None
+        self.details: dict = {}
+        self.started_perf = time.perf_counter()
+
+    def finish(self, status: str, error: str | None = None) -> None:
+        self.status = status
+        self.error = error
+        self.finished_at = datetime.now(timezone.utc)
+        self.duration_s = round(time.perf_counter() - self.started_perf, 3)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "duration_s": self.duration_s,
+            "completed": self.completed,
+            "total": self.total,
+            "details": self.details,
+            "error": self.error,
+        }
+
+class IngestionJob:
+    def __init__(self, filename: str, file_location: str, content_hash: str | None = None, size_bytes: int | None = None, document_id: int | None = None, reindex: bool = False, delete: bool = False) -> None:
+        self.job_id = uuid.uuid4().hex
+        self.filename = filename
+        self.file_location = file_location
+        self.document_id = document_id
+        self.reindex = reindex
+        self.delete = delete
+        self.content_hash = content_hash
+        self.size_bytes = size_bytes
+        self.status = "queued"
+        self.created_at = datetime.now(timezone.utc)
+        self.started_at: datetime | None = None
+        self.finished_at: datetime | None = None
+        self.error: str | None = None
+        self.stages: List[IngestionStage] = []
+        self.lock = threading.Lock()
+
+    def start_stage(self, name: str) -> IngestionStage:
+        stage = IngestionStage(name)
+        with self.lock:
+            self.stages.append(stage)
+        return stage
+
+    def track(self, stages: Dict[str, IngestionStage], name: str, status: str, items: int, error: str | None = None) -> None:
+        # Progress callback for StreamPipeline, whose stages run concurrently and cannot use the stage() context
+        if name not in stages:
+            stages[name] = self.start_stage(name)
+
+        stages[name].completed = items
+        if status != "running":
+            stages[name].finish(status, error=error)
+
+    @contextmanager
+    def stage(self, name: str):
+        stage = self.start_stage(name)
+
+        try:
+            yield stage
+        except Exception as excp:
+            stage.finish("failed", error=str(excp))
+            raise
+        stage.finish("completed")
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            stages = [stage.to_dict() for stage in self.stages]
+
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "document_id": self.document_id,
+            "reindex": self.reindex,
+            "delete": self.delete,
+            "content_hash": self.content_hash,
+            "size_bytes": self.size_bytes,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "error": self.error,
+            "stages": stages,
+        }
+
+class IngestionPipeline:
+    def __init__(self, doc: Document, db: DBHandler, llm: LLM, blob: Blob) -> None:
+        self.doc = doc
+        self.db = db
+        self.llm = llm
+        self.blob = blob
+
+    def __hash_file__(self, file_location: str, chunk_size: int = 1024 * 1024) -> str:
+        sha256 = hashlib.sha256()
+        with open(file_location, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def rehome_image_references(self, document_id: int, vector_ids: List[str], rewritten: Set[Tuple[int, int]] | None = None) -> None:
+        """Re-embeds one surviving copy of each of this document's images that other images reuse, under that copy's
+        own position, and points every copy at the new vector. Call before the old vectors are removed or overwritten.
+
+        Copies within this document survive unless their position is in rewritten, None means the document goes away."""
+        vector_ids = [vector_id for vector_id in vector_ids if image_vector_owner("images", vector_id) in (None, document_id)]
+        references = self.db.get_image_references(vector_ids=vector_ids) if vector_ids else []
+        if references is None:
+            raise RuntimeError("Could not load the images that reuse this document's vectors")
+        references = [
+            reference for reference in references
+            if reference["document_id"] != document_id or (rewritten is not None and (reference["page_no"], reference["image_no"]) not in rewritten)
+        ]
+
+        # References come ordered by document and position, so the first copy of each vector is re-embedded
+        copies: Dict[str, Dict] = {}
+        for reference in references:
+            copies.setdefault(reference["vector_id"], reference)
+        wanted: Dict[int, Dict[Tuple[int, int], Dict]] = {}
+        for reference in copies.values():
+            wanted.setdefault(reference["document_id"], {})[(reference["page_no"], reference["image_no"])] = reference
+
+        for copy_document_id, positions in wanted.items():
+            document = self.db.get_document(copy_document_id)
+            if not document or not os.path.exists(document["path"]):
+                log.log_event("SYSTEM", f"[INGESTION] Document {copy_document_id} is missing its file, {len(positions)} of its images lose their vector")
+                continue
+
+            document_name = os.path.splitext(os.path.basename(document["path"]))[0]
+            for page in ParsedDocument.iter_pages(document["path"]):
+                for image in page.images:
+                    reference = positions.get((page.number, image.index + 1))
+                    if reference is None:
+                        continue
+                    extracted = self.doc.extract_image(document_name, page, image)
+                    description = reference["description"] or self.doc.describe_image(self.llm, extracted)
+                    [(new_vector_id, _)] = self.doc.upsert_image_batch(images=[extracted], descriptions=[description], document_id=copy_document_id)
+                    document_ids = {other["document_id"] for other in references if other["vector_id"] == reference["vector_id"]}
+                    if not self.db.move_image_references(vector_id=reference["vector_id"], new_vector_id=new_vector_id, document_ids=document_ids):
+                        raise RuntimeError(f"Could not move the references to {reference['vector_id']}")
+
+        if copies:
+            log.log_event("SYSTEM", f"[INGESTION] Re-embedded {len(copies)} reused images of document {document_id}")
+
+    def __require__(self, result: Any, action: str) -> Any:
+        # DBHandler logs and returns None on failure, which must not be mistaken for a finished write
+        if result is None:
+            raise RuntimeError(f"Could not {action}")
+        return result
+
+    def __discard_document__(self, document_id: int, document_name: str, text_ids: List[str], image_ids: List[str]) -> None:
+        try:
+            self.rehome_image_references(document_id=document_id, vector_ids=image_ids)
+            # Also deletes by id prefix, which covers vectors written before the failure but never collected
+            self.doc.delete_document_vectors(document_id=document_id, text_ids=text_ids, image_ids=image_ids)
+            self.db.delete_document(document_id)
+            self.doc.delete_extracted_images(document_name=document_name)
+            log.log_event("SYSTEM", f"[INGESTION] Removed partially ingested document {document_id}")
+        except Exception as excp:
+            log.log_event("SYSTEM", f"[INGESTION] Cleanup of partially ingested document {document_id} failed. {excp}")
+
+    def delete(self, job: IngestionJob, image_folder: str = "./images") -> None:
+        # Runs as an exclusive job, so no ingestion can write vectors or hashes back for the document meanwhile
+        document_id = cast(int, job.document_id)
+
+        with job.stage("load") as stage:
+            document = self.db.get_document(document_id)
+            if document is None:
+                raise RuntimeError(f"Document {document_id} does not exist")
+            vector_ids = self.__require__(self.db.get_document_vector_ids(document_id), "load the document's vector ids")
+            stage.details = {"text_vectors": len(vector_ids["text"]), "image_vectors": len(vector_ids["images"])}
+
+        # Images other documents reuse get a vector of their own before this document's are deleted
+        with job.stage("rehome_images"):
+            self.rehome_image_references(document_id=document_id, vector_ids=vector_ids["images"])
+
+        # Vectors go first, a failure here leaves the rows in place so the delete can be retried
+        with job.stage("delete_vectors"):
+            self.doc.delete_document_vectors(document_id=document_id, text_ids=vector_ids["text"], image_ids=vector_ids["images"])
+
+        with job.stage("delete_rows"):
+            self.__require__(self.db.delete_document(document_id), "delete the database rows after the vectors")
+
+        # A newer upload under the same name shares the file and the extracted image names, a failed lookup keeps them
+        with job.stage("delete_files") as stage:
+            if self.db.get_document_by_name(document["name"]) == {}:
+                if os.path.exists(document["path"]):
+                    os.remove(document["path"])
+                stage.details = {"extracted_images": self.doc.delete_extracted_images(document_name=os.path.splitext(document["name"])[0], output_dir=image_folder)}
+
+    def run(self, job: IngestionJob) -> None:
+        file_location = job.file_location
+        content_hash = job.content_hash or self.__hash_file__(file_location)
+        size_bytes = job.size_bytes if job.size_bytes is not None else os.path.getsize(file_location)
+
+        with job.stage("file_check") as stage:
+            if job.document_id is not None:
+                existing = self.db.get_document(job.document_id)
+                if existing is None:
+                    raise RuntimeError(f"Document {job.document_id} does not exist")
+            else:
+                # An empty result means no such document, None that the lookup failed and the job must not
+                # create a second row for a document that may already exist
+                existing = self.__require__(self.db.get_document_by_name(os.path.basename(file_location)), "look up the document by name") or None
+
+            # A reindex rebuilds every vector even when the file itself has not changed
+            unchanged = not job.reindex and existing is not None and self.db.get_document_file_hash(existing["document_id"]) == content_hash
+            stage.details = {"existing_document": bool(existing), "unchanged": unchanged, "reindex": job.reindex}
+
+        if unchanged:
+            log.log_event("SYSTEM", f"[INGESTION] {job.filename} is identical to the stored copy, skipping ingestion")
+            return
+
+        if not job.reindex:
+            with job.stage("blob_upload"):
+                self.blob.upload_file(service=self.blob.authenticate(), file_path=file_location, folder_name="Documents")
+
+        with job.stage("prepare") as stage:
+            old_pages = self.db.get_page_hashes(existing["document_id"]) if existing else {}
+            old_images = self.db.get_image_hashes(existing["document_id"]) if existing else {}
+            if old_pages is None or old_images is None:
+                raise RuntimeError("Could not load stored content hashes")
+
+            if existing:
+                document_id = existing["document_id"]
+                if not old_pages:
+                    log.log_event("SYSTEM", f"[INGESTION] {os.path.basename(file_location)} has no stored page hashes, its earlier vectors cannot be replaced")
+            else:
+                # The row is created up front so every stage can key its bookkeeping on it, the summary is filled in later
+                document = self.db.insert_document(path=file_location, description=None, vectorized=True)
+                if not document:
+                    raise RuntimeError("Document insertion failed")
+                document_id = document["document_id"]
+            job.document_id = document_id
+
+            # This document's own vectors are either kept (and registered as canonical while streaming) or about to be replaced,
+            # its rows for images reused from other documents are matched again through those documents' rows
+            fingerprints = [
+                fingerprint for fingerprint in self.db.get_image_fingerprints() or []
+                if fingerprint["document_id"] != document_id and image_vector_owner("images", fingerprint["vector_id"]) != document_id
+            ]
+
+        basename = os.path.basename(file_location)
+        document_name = os.path.splitext(basename)[0]
+        new_pages: Dict[int, str] = {}
+        new_images: Dict[Tuple[int, int], str] = {}
+        page_texts: List[str] = []
+        page_vector_ids: Dict[int, List[str]] = {}
+        image_results: List[Tuple[Dict, str, str | None]] = []
+        dedup_report: Dict[str, int] = {}
+        image_references: Dict[Tuple[int, int], Dict] = {}
+        summary: Dict[str, str | None] = {}
+
+        try:
+            def page_changed(page: ParsedPage) -> bool:
+                return job.reindex or old_pages.get(page.number, {}).get("content_hash") != page.content_hash
+
+            def image_changed(page: ParsedPage, image: ParsedImage) -> bool:
+                return job.reindex or old_images.get((page.number, image.index + 1), {}).get("content_hash") != image.content_hash
+
+            def owns_image_vector(key: Tuple[int, int], vector_id: str) -> bool:
+                # A duplicate's row names another position's vector, legacy ids belong to the row storing them
+                return vector_id == image_vector_id("images", document_id, key[0], key[1]) or image_vector_owner("images", vector_id) is None
+
+            def collect_pages(pages: Iterator[ParsedPage]) -> None:
+                for page in pages:
+                    new_pages[page.number] = page.content_hash
+                    page_texts.append(page.text)
+                    for image in page.images:
+                        new_images[(page.number, image.index + 1)] = image.content_hash
+
+                if not existing or job.reindex or set(new_pages) != set(old_pages) or any(old_pages[page_no]["content_hash"] != content_hash for page_no, content_hash in new_pages.items()):
+                    summary["text"] = self.doc.create_document_summary(llm=self.llm, document_path=file_location, db=self.db, page_texts=page_texts)
+
+            def upsert_text(batches: Iterator[List[Dict]]) -> None:
+                for batch in batches:
+                    for record in batch:
+                        page_vector_ids.setdefault(record["page_no"], []).append(record["_id"])
+
+            def upsert_images(described: Iterator[Tuple[Dict, str | None]]) -> None:
+                for batch in batched(described, CLIP_BATCH_SIZE):
+                    images = [image for image, _ in batch]
+                    results = self.doc.upsert_image_batch(images=images, descriptions=[description for _, description in batch], document_id=document_id)
+                    image_results.extend((image, vector_id, description) for image, (vector_id, description) in zip(images, results))
+
+            # Pages stream through bounded queues, so text upserts and image descriptions start
+            # while later pages are still being parsed and only a window of pages is held in memory
+            pipeline_stages: Dict[str, IngestionStage] = {}
+            pipeline = StreamPipeline(name=f"ingest-{job.job_id[:8]}", on_progress=lambda name, status, items, error: job.track(pipeline_stages, name, status, items, error))
+            pages = pipeline.source("parse", ParsedDocument.iter_pages(file_location))
+            text_pages, image_pages, summary_pages = pipeline.tee("fan_out", pages, 3)
+
+            chunks = pipeline.stage("chunk", lambda items: self.doc.iter_text_records((page for page in items if page_changed(page)), source=basename, document_id=document_id), text_pages)
+            batches = pipeline.stage("text_upsert", lambda items: self.doc.upsert_text_records(items), chunks)
+            pipeline.sink("text_collect", upsert_text, batches)
+
+            unique = pipeline.stage("image_dedup", lambda items: self.doc.iter_unique_images(items, include=image_changed, fingerprints=fingerprints, report=dedup_report, references=image_references), image_pages)
+            extracted = pipeline.stage("image_extraction", lambda items: (self.doc.extract_image(document_name, page, image) for page, image in items), unique)
+            described = pipeline.stage("image_description", lambda items: parallel_map(lambda image: (image, self.doc.describe_image(self.llm, image)), items, IMAGE_DESCRIPTION_CONCURRENCY), extracted)
+            pipeline.sink("image_upsert", upsert_images, described)
+
+            pipeline.sink("summary", collect_pages, summary_pages)
+            pipeline.run()
+
+            with job.stage("finalize") as stage:
+                changed_pages = {page_no for page_no, content_hash in new_pages.items() if job.reindex or old_pages.get(page_no, {}).get("content_hash") != content_hash}
+                removed_pages = set(old_pages) - set(new_pages)
+                changed_images = {key for key, content_hash in new_images.items() if job.reindex or old_images.get(key, {}).get("content_hash") != content_hash}
+                removed_images = set(old_images) - set(new_images)
+                stage.details = {
+                    "pages_changed": len(changed_pages),
+                    "pages_removed": len(removed_pages),
+                    "images_changed": len(changed_images),
+                    "images_removed": len(removed_images),
+                    "image_dedup": dedup_report,
+                }
+
+                if "text" in summary:
+                    self.__require__(self.db.update_document_description(document_id=document_id, description=summary["text"]), "save the document summary")
+
+                # New vectors went in before the stale ones are removed so retrieval never sees a gap. Ids are
+                # deterministic, so only ids the new version no longer produces (fewer chunks, legacy ids) are stale
+                fresh_ids = {vector_id for ids in page_vector_ids.values() for vector_id in ids}
+                stale_ids = [vector_id for page_no in changed_pages | removed_pages for vector_id in old_pages.get(page_no, {}).get("vector_ids", []) if vector_id not in fresh_ids]
+                if stale_ids:
+                    self.doc.delete_text_vectors(stale_ids)
+
+                self.__require__(self.db.save_page_hashes(document_id=document_id, pages={page_no: (new_pages[page_no], page_vector_ids.get(page_no, [])) for page_no in changed_pages}), "save page hashes")
+                if removed_pages:
+                    self.__require__(self.db.delete_page_hashes(document_id=document_id, page_nos=removed_pages), "delete page hashes")
+
+                # A reindex regenerates the same ids from the same images, so only vectors that go away or now hold a
+                # different image have their copies, here or in other documents, moved to vectors of their own
+                rewritten_images = changed_images | removed_images
+                replaced_image_ids = {old_images[key]["vector_id"] for key in rewritten_images if key in old_images and old_images[key]["vector_id"]}
+                fresh_image_ids = {vector_id for _, vector_id, _ in image_results}
+                moved_image_ids = [
+                    old_images[key]["vector_id"] for key in rewritten_images
+                    if key in old_images and old_images[key]["vector_id"] and owns_image_vector(key, old_images[key]["vector_id"])
+                    and (key in removed_images or new_images[key] != old_images[key]["content_hash"] or old_images[key]["vector_id"] not in fresh_image_ids)
+                ]
+                self.rehome_image_references(document_id=document_id, vector_ids=moved_image_ids, rewritten=rewritten_images)
+                stale_image_ids = [vector_id for vector_id in moved_image_ids if vector_id not in fresh_image_ids]
+                if stale_image_ids:
+                    self.doc.delete_image_vectors(stale_image_ids)
+
+                # Unchanged duplicates may still use a replaced vector and keep their fingerprint rows, rehomed rows were moved
+                kept_image_ids = {image["vector_id"] for key, image in old_images.items() if key not in rewritten_images and image["vector_id"]} - set(moved_image_ids)
+                if replaced_image_ids - kept_image_ids:
+                    self.__require__(self.db.delete_image_fingerprints(document_id=document_id, vector_ids=replaced_image_ids - kept_image_ids), "delete image fingerprints")
+
+                # Cross-document duplicates store the matched image's vector, duplicates within the document the vector
+                # of their canonical position, which comes earlier and was either upserted now or left unchanged
+                image_vector_ids: Dict[Tuple[int, int], str | None] = {key: None for key in changed_images}
+                for image, vector_id, _ in image_results:
+                    image_vector_ids[(image["page_number"], image["image_number"])] = vector_id
+                for key, reference in image_references.items():
+                    if "vector_id" in reference:
+                        image_vector_ids[key] = reference["vector_id"]
+                for key, reference in image_references.items():
+                    if "key" in reference:
+                        image_vector_ids[key] = image_vector_ids.get(reference["key"]) if reference["key"] in changed_images else old_images.get(reference["key"], {}).get("vector_id")
+
+                # Each document keeps a fingerprint row with the description of every vector it uses, which is what
+                # rehome_image_references reads when the original document goes away
+                new_fingerprints: Dict[str, Dict] = {}
+                for reference in image_references.values():
+                    if "vector_id" in reference:
+                        new_fingerprints.setdefault(reference["vector_id"], reference)
+                for image, vector_id, description in image_results:
+                    new_fingerprints[vector_id] = {"perceptual_hash": image["perceptual_hash"], "description": description, "vector_id": vector_id}
+
+                self.__require__(self.db.save_image_hashes(document_id=document_id, images={key: (new_images[key], vector_id) for key, vector_id in image_vector_ids.items()}), "save image hashes")
+                self.__require__(self.db.add_image_fingerprints(document_id=document_id, fingerprints=[fingerprint for vector_id, fingerprint in new_fingerprints.items() if vector_id not in kept_image_ids]), "save image fingerprints")
+                if removed_images:
+                    self.__require__(self.db.delete_image_hashes(document_id=document_id, keys=removed_images), "delete image hashes")
+
+            # Written last, a stored file hash makes the next upload of the same file skip ingestion
+            self.__require__(self.db.save_document_file_hash(document_id=document_id, content_hash=content_hash, size_bytes=size_bytes), "save the file hash")
+        except Exception:
+            # Hashes are only saved once everything succeeded, so an existing document is repaired by the next
+            # upload or reindex. A document created by this job would otherwise stay half-ingested in retrieval
+            if not existing:
+                self.__discard_document__(document_id=document_id, document_name=document_name, text_ids=[vector_id for ids in page_vector_ids.values() for vector_id in ids], image_ids=[vector_id for _, vector_id, _ in image_results if vector_id])
+            raise
+
+class IngestionQueue:
+    def __init__(self, max_concurrency: int = INGESTION_MAX_CONCURRENCY, retention: int = INGESTION_JOB_RETENTION) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ingestion")
+        self.retention = retention
+        self.jobs: Dict[str, IngestionJob] = {}
+        self.lock = threading.Lock()
+
+    def __prune__(self) -> None:
+        finished = [job for job in self.jobs.values() if job.status in ("completed", "failed")]
+        for job in sorted(finished, key=lambda j: j.created_at)[:max(0, len(finished) - self.retention)]:
+            del self.jobs[job.job_id]
+
+    def __run__(self, job: IngestionJob, pipeline: Callable[[IngestionJob], None]) -> None:
+        job.status = "running"
+        job.started_at = datetime.now(timezone.utc)
+        log.log_event("SYSTEM", f"[INGESTION] Job {job.job_id} started for {job.filename}")
+
+        try:
+            pipeline(job)
+            job.status = "completed"
+            log.log_event("SYSTEM", f"[INGESTION] Job {job.job_id} completed")
+        except Exception as excp:
+            job.status = "failed"
+            job.error = str(excp)
+            log.log_event("SYSTEM", f"[INGESTION] Job {job.job_id} failed. {excp}")
+        finally:
+            job.finished_at = datetime.now(timezone.utc)
+
+    def __active__(self, document_id: int | None, file_location: str | None) -> IngestionJob | None:
+        # Upload jobs only learn their document_id once they run, so the file location is matched as well
+        for job in self.jobs.values():
+            if job.status in ("queued", "running") and ((document_id is not None and job.document_id == document_id) or (file_location is not None and job.file_location == file_location)):
+                return job
+        return None
+
+    def active(self, document_id: int | None = None, file_location: str | None = None) -> IngestionJob | None:
+        with self.lock:
+            return self.__active__(document_id, file_location)
+
+    def submit(self, filename: str, file_location: str, pipeline: Callable[[IngestionJob], None], content_hash: str | None = None, size_bytes: int | None = None, document_id: int | None = None, reindex: bool = False, delete: bool = False, exclusive: bool = False, on_accept: Callable[[], None] | None = None) -> IngestionJob | None:
+        """Queues a job. An exclusive job is refused with None while another job for the same document or file is
+        queued or running, and on_accept runs under the lock once the job is accepted, before anything else can start."""
+        job = IngestionJob(filename=filename, file_location=file_location, content_hash=content_hash, size_bytes=size_bytes, document_id=document_id, reindex=reindex, delete=delete)
+
+        with self.lock:
+            # Checked under the lock so two concurrent requests cannot both start a job for the same document
+            if exclusive and self.__active__(document_id, file_location) is not None:
+                return None
+            if on_accept is not None:
+                on_accept()
+            self.__prune__()
+            self.jobs[job.job_id] = job
+
+        self.executor.submit(self.__run__, job, pipeline)
+        log.log_event("SYSTEM", f"[INGESTION] Job {job.job_id} queued for {filename}")
+        return job
+
+    def get(self, job_id: str) -> IngestionJob | None:
+        with self.lock:
+            return self.jobs.get(job_id)
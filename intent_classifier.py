@@ -0,0 +1,258 @@
+from typing import Deque, Dict, List, Tuple, cast
+from collections import deque
+from vector_store import HashingEmbedder
+from dotenv import load_dotenv
+from logger import Logger
+import numpy as np
+import threading
+import json
+import os
+import re
+
+load_dotenv()
+log = Logger()
+
+INTENT_CLASSIFIER = os.environ.get("INTENT_CLASSIFIER", "true").lower() == "true"
+INTENT_CONFIDENCE = float(os.environ.get("INTENT_CONFIDENCE", "0.9"))
+INTENT_MIN_SIMILARITY = float(os.environ.get("INTENT_MIN_SIMILARITY", "0.6"))
+INTENT_NEIGHBOURS = int(os.environ.get("INTENT_NEIGHBOURS", "7"))
+INTENT_MIN_EXAMPLES = int(os.environ.get("INTENT_MIN_EXAMPLES", "50"))
+INTENT_MAX_EXAMPLES = int(os.environ.get("INTENT_MAX_EXAMPLES", "1000"))
+INTENT_DIMENSION = int(os.environ.get("INTENT_DIMENSION", "1024"))
+INTENT_EXAMPLES_PATH = os.environ.get("INTENT_EXAMPLES_PATH", "intent_examples.jsonl")
+
+LABELS = ("Valid RAG Question", "Greeting", "Off-Topic")
+# Off-Topic answers depend on the document descriptions, so only these two are ever decided locally
+FAST_PATH_LABELS = ("Valid RAG Question", "Greeting")
+
+# English and Roman Urdu greetings, thanks and acknowledgements
+GREETING_TERMS = {
+    "hi", "hii", "hello", "hey", "hiya", "yo", "salam", "salaam", "assalam", "assalamualaikum", "asalamualaikum", "aoa", "alaikum",
+    "walaikum", "morning", "afternoon", "evening", "thanks", "thank", "thx", "ty", "shukriya", "shukria", "meherbani", "ok", "okay",
+    "k", "kk", "cool", "great", "nice", "awesome", "bye", "goodbye", "later", "allah", "hafiz", "khuda", "haal", "hal", "theek", "thik",
+}
+# Replies like "ok" or "thanks" can answer a question in the conversation, so they are only decided locally without history
+ACKNOWLEDGEMENT_TERMS = {
+    "thanks", "thank", "thx", "ty", "shukriya", "shukria", "meherbani", "ok", "okay", "k", "kk", "cool", "great", "nice", "awesome",
+    "theek", "thik",
+}
+GREETING_FILLERS = {
+    "o", "u", "good", "very", "so", "much", "you", "how", "are", "r", "doing", "see", "bohat", "bahut", "aap", "ap", "kaise", "kese",
+    "ho", "hain", "hai", "kya", "kia", "sab", "there", "all", "sir", "madam", "bot", "again", "got", "it", "a", "lot", "lots", "alot",
+}
+
+class Intent:
+    def __init__(self, label: str | None, confidence: float, source: str, guess: str | None = None) -> None:
+        self.label = label
+        self.confidence = confidence
+        self.source = source
+        self.guess = guess
+
+class IntentClassifier:
+    """Decides clear Greeting and Valid RAG Question inputs locally so the validator LLM only sees the uncertain ones.
+
+    Greetings are matched by lexical rules. Everything else goes through a k-nearest-neighbour vote over
+    hashed embeddings of inputs the validator LLM has already labelled, only for messages without earlier
+    conversation. Each label keeps its most recent max_examples inputs in a preallocated matrix. Those inputs are
+    raw user text, so they are kept in their own owner-only file rather than the shared log."""
+
+    def __init__(self, examples_path: str = INTENT_EXAMPLES_PATH, threshold: float = INTENT_CONFIDENCE, min_similarity: float = INTENT_MIN_SIMILARITY, neighbours: int = INTENT_NEIGHBOURS, min_examples: int = INTENT_MIN_EXAMPLES, max_examples: int = INTENT_MAX_EXAMPLES) -> None:
+        self.examples_path = examples_path
+        self.threshold = threshold
+        self.min_similarity = min_similarity
+        self.neighbours = neighbours
+        self.min_examples = min_examples
+        self.max_examples = max_examples
+        self.embed = HashingEmbedder(dimension=INTENT_DIMENSION)
+        # Rows are slots, a label's slots are recycled oldest first once it holds max_examples inputs
+        capacity = max_examples * len(LABELS)
+        self.vectors = np.zeros((capacity, INTENT_DIMENSION), dtype=np.float32)
+        self.used = np.zeros(capacity, dtype=bool)
+        self.slot_texts: List[str | None] = [None] * capacity
+        self.labels: List[str | None] = [None] * capacity
+        self.texts: Dict[str, int] = {}
+        self.queues: Dict[str, Deque[int]] = {label: deque() for label in LABELS}
+        self.free = list(range(capacity - 1, -1, -1))
+        self.appended = 0
+        self.counts = {"rules": 0, "model": 0, "llm": 0}
+        self.shadow = {"agree": 0, "disagree": 0}
+        self.lock = threading.Lock()
+        self.file_lock = threading.Lock()
+
+        if os.path.exists(examples_path):
+            os.chmod(examples_path, 0o600)
+            self.load_examples(examples_path)
+
+    def __normalize__(self, text: str) -> str:
+        return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+    def __vector__(self, text: str) -> np.ndarray:
+        vector = self.embed([text])[0]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def __rules__(self, text: str, has_history: bool) -> str | None:
+        words = text.split()
+        if not words or len(words) > 8:
+            return None
+
+        anchors = GREETING_TERMS - ACKNOWLEDGEMENT_TERMS if has_history else GREETING_TERMS
+        if all(word in GREETING_TERMS or word in GREETING_FILLERS for word in words) and any(word in anchors for word in words):
+            return "Greeting"
+        return None
+
+    def __vote__(self, text: str) -> Tuple[str | None, float]:
+        vector = self.__vector__(text)
+        with self.lock:
+            if len(self.texts) < self.min_examples:
+                return None, 0.0
+
+            similarities = np.where(self.used, self.vectors @ vector, -np.inf)
+            nearest = np.argsort(-similarities)[:self.neighbours]
+            nearest = nearest[similarities[nearest] >= self.min_similarity]
+            if not len(nearest):
+                return None, 0.0
+
+            # Similarity-weighted vote, so one near-duplicate outweighs several loose matches
+            votes: Dict[str, float] = {}
+            for row in nearest:
+                label = cast(str, self.labels[row])
+                votes[label] = votes.get(label, 0.0) + float(similarities[row])
+        label = max(votes, key=lambda key: votes[key])
+        return label, votes[label] / sum(votes.values())
+
+    def __release__(self, slot: int) -> None:
+        del self.texts[cast(str, self.slot_texts[slot])]
+        self.queues[cast(str, self.labels[slot])].remove(slot)
+        self.slot_texts[slot] = self.labels[slot] = None
+        self.used[slot] = False
+        self.free.append(slot)
+
+    def add_example(self, text: str, label: str) -> None:
+        text = self.__normalize__(text)
+        if not text or label not in LABELS:
+            return
+
+        vector = self.__vector__(text)
+        with self.lock:
+            # A later label for the same input replaces the earlier one and counts as its newest example
+            if text in self.texts:
+                self.__release__(self.texts[text])
+            if len(self.queues[label]) >= self.max_examples:
+                self.__release__(self.queues[label][0])
+
+            slot = self.free.pop()
+            self.vectors[slot] = vector
+            self.used[slot] = True
+            self.slot_texts[slot] = text
+            self.labels[slot] = label
+            self.texts[text] = slot
+            self.queues[label].append(slot)
+
+    def __read_examples__(self, path: str) -> Dict[str, str] | None:
+        # Later lines win and move the input to the end, which is the order FIFO eviction needs
+        examples: Dict[str, str] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self.appended += 1
+                    example = json.loads(line)
+                    text = self.__normalize__(example["text"])
+                    if text and example.get("label") in LABELS:
+                        examples.pop(text, None)
+                        examples[text] = example["label"]
+        except (OSError, ValueError, KeyError) as e:
+            log.log_event("SYSTEM", f"[INTENT] Failed to read labelled inputs from {path} - {e}")
+            return None
+        return examples
+
+    def load_examples(self, path: str) -> None:
+        examples = self.__read_examples__(path)
+        if examples is None:
+            return
+
+        # Only the newest max_examples inputs of each label would survive, so older ones are never embedded
+        kept = {label: 0 for label in LABELS}
+        newest = []
+        for text in reversed(list(examples)):
+            if kept[examples[text]] < self.max_examples:
+                kept[examples[text]] += 1
+                newest.append(text)
+        for text in reversed(newest):
+            self.add_example(text, examples[text])
+        log.log_event("SYSTEM", f"[INTENT] Loaded {len(self.texts)} labelled inputs from {path}")
+
+    def __append_example__(self, text: str, label: str) -> None:
+        try:
+            with self.file_lock:
+                fd = os.open(self.examples_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+                with os.fdopen(fd, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"text": text, "label": label}) + "\n")
+                self.appended += 1
+
+                # The file only needs what the matrix can hold, so it is rewritten once it holds twice that
+                if self.appended > self.vectors.shape[0]:
+                    self.__rewrite_examples__()
+        except OSError as e:
+            log.log_event("SYSTEM", f"[INTENT] Failed to store labelled input - {e}")
+
+    def __rewrite_examples__(self) -> None:
+        with self.lock:
+            examples = [(self.slot_texts[slot], label) for label, queue in self.queues.items() for slot in queue]
+
+        partial_path = self.examples_path + ".part"
+        fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for text, label in examples:
+                f.write(json.dumps({"text": text, "label": label}) + "\n")
+        os.replace(partial_path, self.examples_path)
+        self.appended = 0
+
+    def classify(self, text: str, has_history: bool = False) -> Intent:
+        normalized = self.__normalize__(text)
+
+        label = self.__rules__(normalized, has_history)
+        if label is not None:
+            self.counts["rules"] += 1
+            return Intent(label=label, confidence=1.0, source="rules")
+
+        # Stored examples carry no conversation, so they say nothing about what a follow-up means
+        if has_history:
+            self.counts["llm"] += 1
+            return Intent(label=None, confidence=0.0, source="llm")
+
+        guess, confidence = self.__vote__(normalized)
+        if guess in FAST_PATH_LABELS and confidence >= self.threshold:
+            self.counts["model"] += 1
+            return Intent(label=guess, confidence=confidence, source="model")
+
+        self.counts["llm"] += 1
+        return Intent(label=None, confidence=confidence, source="llm", guess=guess)
+
+    def record(self, text: str, label: str | None, intent: Intent, has_history: bool = False) -> None:
+        # A follow-up's label depends on the conversation, which the examples cannot replay
+        if label not in LABELS or has_history:
+            return
+
+        # Agreement of the below-threshold guesses with the LLM shows whether the threshold can be lowered
+        if intent.guess is not None:
+            self.shadow["agree" if intent.guess == label else "disagree"] += 1
+        self.add_example(text, label)
+        # Only validator LLM labels are persisted, never the classifier's own decisions
+        self.__append_example__(text, label)
+
+    def stats(self) -> dict:
+        decisions = sum(self.counts.values())
+        shadowed = sum(self.shadow.values())
+        return {
+            "enabled": INTENT_CLASSIFIER,
+            "threshold": self.threshold,
+            "min_similarity": self.min_similarity,
+            "neighbours": self.neighbours,
+            "min_examples": self.min_examples,
+            "max_examples": self.max_examples,
+            "examples": {label: len(queue) for label, queue in self.queues.items()},
+            "decisions": dict(self.counts),
+            "fallback_rate": round(self.counts["llm"] / decisions, 4) if decisions else None,
+            "shadow_agreement": round(self.shadow["agree"] / shadowed, 4) if shadowed else None,
+        }
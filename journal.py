@@ -0,0 +1,122 @@
+from typing import Any, Dict, Iterator, List, Tuple
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from logger import Logger
+import fcntl
+import json
+import uuid
+import os
+
+load_dotenv()
+log = Logger()
+
+JOURNAL_CHECKPOINT_BYTES = int(os.environ.get("JOURNAL_CHECKPOINT_BYTES", str(8 * 1024 * 1024)))
+
+class Journal:
+    """A JSON checkpoint plus an append-only JSON lines journal of the changes made since, shared by every process.
+
+    Writers append one line per batch under an exclusive file lock, so a batch costs its own size rather than the
+    whole state. Every process replays the lines it has not seen yet before reading or writing. The checkpoint is
+    only rewritten once the journal outgrows it. The journal is then replaced by one that starts with a new token,
+    which other processes notice and answer by reloading the checkpoint."""
+
+    def __init__(self, checkpoint_path: str, journal_path: str, checkpoint_bytes: int = JOURNAL_CHECKPOINT_BYTES) -> None:
+        self.checkpoint_path = checkpoint_path
+        self.journal_path = journal_path
+        self.lock_path = journal_path + ".lock"
+        self.checkpoint_bytes = checkpoint_bytes
+        self.token: str | None = None
+        self.offset = 0
+        self.checkpoint_size = 0
+
+    @contextmanager
+    def locked(self, exclusive: bool) -> Iterator[None]:
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    def load_checkpoint(self) -> Dict[str, Any] | None:
+        if not os.path.exists(self.checkpoint_path):
+            self.checkpoint_size = 0
+            return None
+
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        self.checkpoint_size = os.path.getsize(self.checkpoint_path)
+        return state
+
+    def __header__(self) -> bytes:
+        self.token = uuid.uuid4().hex
+        return (json.dumps({"checkpoint": self.token}) + "\n").encode("utf-8")
+
+    def read(self) -> Tuple[bool, List[Dict[str, Any]]]:
+        """Returns whether the checkpoint has to be reloaded, then the entries appended since the last read.
+
+        Call with the lock held."""
+        try:
+            with open(self.journal_path, "rb") as f:
+                # A checkpoint starts a journal under a new token, a header torn by a crash counts as no journal
+                header = f.readline()
+                token = json.loads(header)["checkpoint"] if header.endswith(b"\n") else None
+                f.seek(self.offset if token == self.token else len(header))
+                data = f.read()
+        except FileNotFoundError:
+            header, token, data = b"", None, b""
+
+        reset = token != self.token
+        if reset:
+            self.token = token
+            self.offset = len(header) if token else 0
+        if not token:
+            return reset, []
+
+        # A line without its newline was torn by a crashed writer, the next append truncates it
+        end = data.rfind(b"\n") + 1
+        entries = []
+        for line in data[:end].splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError as e:
+                log.log_event("SYSTEM", f"[JOURNAL] Skipped an unreadable entry in {self.journal_path} - {e}")
+        self.offset += end
+        return reset, entries
+
+    def append(self, entry: Dict[str, Any]) -> bool:
+        """Appends one entry and returns whether a checkpoint is due. Call with the exclusive lock held, after read."""
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        if not self.token:
+            line = self.__header__() + line
+        fd = os.open(self.journal_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, self.offset)
+            os.lseek(fd, self.offset, os.SEEK_SET)
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+        self.offset += len(line)
+        return self.offset > max(self.checkpoint_bytes, self.checkpoint_size)
+
+    def checkpoint(self, state: Dict[str, Any]) -> None:
+        """Writes the full state and starts an empty journal. Call with the exclusive lock held."""
+        header = self.__header__()
+        for path, content in ((self.checkpoint_path, json.dumps(state).encode("utf-8")), (self.journal_path, header)):
+            partial_path = path + ".part"
+            with open(partial_path, "wb") as f:
+                f.write(content)
+            os.replace(partial_path, path)
+
+        self.offset = len(header)
+        self.checkpoint_size = os.path.getsize(self.checkpoint_path)
+
+    def remove(self) -> None:
+        for path in (self.checkpoint_path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.token = None
+        self.offset = 0
+        self.checkpoint_size = 0
@@ -0,0 +1,183 @@
+from typing import Any, Dict, Iterator, List
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from journal import Journal
+from logger import Logger
+import threading
+import math
+import os
+import re
+
+load_dotenv()
+log = Logger()
+
+LEXICAL_INDEX_PATH = os.environ.get("LEXICAL_INDEX_PATH", "lexical_index")
+BM25_K1 = float(os.environ.get("BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i", "in", "is", "it",
+    "many", "much", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "which", "who", "will", "with",
+}
+
+# Keeps clause numbers, grade names and codes such as "3.2.1", "grade-7" or "ta/da" as single terms
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[./\-][a-z0-9]+)*")
+
+def tokenize(text: str) -> List[str]:
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        parts = re.split(r"[./\-]", token)
+        # Compound tokens are also indexed by their parts so "3.2" still matches "clause 3 2"
+        if len(parts) > 1:
+            terms.append(token)
+        terms.extend(part for part in parts if part not in STOPWORDS)
+    return terms
+
+class BM25Namespace:
+    def __init__(self, path: str, text_field: str = "text") -> None:
+        self.path = path
+        self.text_field = text_field
+        self.docs: Dict[str, List[Any]] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.total_length = 0
+        self.journal = Journal(path, os.path.splitext(path)[0] + ".journal")
+
+    def __load__(self) -> None:
+        state = self.journal.load_checkpoint() or {"docs": {}, "postings": {}}
+        self.docs = state["docs"]
+        self.postings = state["postings"]
+        self.total_length = sum(length for length, _ in self.docs.values())
+
+    def refresh(self) -> None:
+        # Catches up with batches written by other workers, call with the journal lock held
+        reset, entries = self.journal.read()
+        if reset:
+            self.__load__()
+        for entry in entries:
+            self.__apply__(entry)
+
+    def __apply__(self, entry: Dict[str, Any]) -> None:
+        for doc_id in entry.get("delete", []):
+            self.remove(doc_id)
+        for record in entry.get("upsert", []):
+            self.add(record["_id"], record[self.text_field], {key: value for key, value in record.items() if key != "_id"})
+
+    def write(self, entry: Dict[str, Any]) -> None:
+        # Call with the exclusive journal lock held and after refresh
+        self.__apply__(entry)
+        if self.journal.append(entry):
+            self.save()
+
+    def save(self) -> None:
+        self.journal.checkpoint({"docs": self.docs, "postings": self.postings})
+
+    def remove(self, doc_id: str) -> None:
+        entry = self.docs.pop(doc_id, None)
+        if entry is None:
+            return
+
+        self.total_length -= entry[0]
+        for term in set(tokenize(entry[1].get("text", ""))):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def add(self, doc_id: str, text: str, fields: Dict[str, Any]) -> None:
+        self.remove(doc_id)
+        terms = tokenize(text)
+
+        counts: Dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = count
+
+        self.docs[doc_id] = [len(terms), fields]
+        self.total_length += len(terms)
+
+    def search(self, query: str, top_k: int, k1: float, b: float) -> List[tuple]:
+        if not self.docs:
+            return []
+
+        doc_count = len(self.docs)
+        average_length = self.total_length / doc_count or 1.0
+        scores: Dict[str, float] = {}
+
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                length = self.docs[doc_id][0]
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average_length))
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(doc_id, score, self.docs[doc_id][1]) for doc_id, score in ranked]
+
+class LexicalIndex:
+    """BM25 over the same chunk records that go to the vector store, one journaled JSON file per namespace."""
+
+    def __init__(self, path: str = LEXICAL_INDEX_PATH, k1: float = BM25_K1, b: float = BM25_B, text_field: str = "text") -> None:
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.text_field = text_field
+        self.namespaces: Dict[str, BM25Namespace] = {}
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+    @contextmanager
+    def __namespace__(self, namespace: str, exclusive: bool = False) -> Iterator[BM25Namespace]:
+        if namespace not in self.namespaces:
+            self.namespaces[namespace] = BM25Namespace(os.path.join(self.path, f"{namespace}.json"), text_field=self.text_field)
+        index = self.namespaces[namespace]
+
+        # Other workers write to the same files, so every access first replays what they appended
+        with index.journal.locked(exclusive=exclusive):
+            index.refresh()
+            yield index
+
+    def upsert(self, namespace: str, records: List[Dict[str, Any]]) -> None:
+        with self.lock, self.__namespace__(namespace, exclusive=True) as index:
+            index.write({"upsert": list(records)})
+
+    def delete(self, namespace: str, ids: List[str]) -> None:
+        with self.lock, self.__namespace__(namespace, exclusive=True) as index:
+            index.write({"delete": list(ids)})
+
+    def idfs(self, namespace: str, terms: List[str]) -> Dict[str, float]:
+        # One locked pass for the whole query, every pass replays the journal
+        with self.lock, self.__namespace__(namespace) as index:
+            doc_count = len(index.docs)
+            doc_freqs = {term: len(index.postings.get(term, ())) for term in terms}
+        return {term: math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5)) for term, doc_freq in doc_freqs.items()}
+
+    def get(self, namespace: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self.lock, self.__namespace__(namespace) as index:
+            docs = index.docs
+            return {doc_id: dict(docs[doc_id][1]) for doc_id in ids if doc_id in docs}
+
+    def search(self, namespace: str, top_k: int, text: str, fields: List[str] | None = None) -> List[Dict[str, Any]]:
+        with self.lock, self.__namespace__(namespace) as index:
+            matches = index.search(text, top_k, self.k1, self.b)
+
+        return [
+            {"id": doc_id, "score": score, "fields": {key: value for key, value in metadata.items() if fields is None or key in fields}}
+            for doc_id, score, metadata in matches
+        ]
+
+def reciprocal_rank_fusion(rankings: List[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
+    # Only ranks are compared, so BM25 and cosine scores never need to be calibrated against each other
+    fused: Dict[str, Dict[str, Any]] = {}
+
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking):
+            entry = fused.setdefault(hit["id"], {"id": hit["id"], "score": 0.0, "fields": {}})
+            entry["score"] += 1.0 / (k + rank + 1)
+            entry["fields"] = {**hit["fields"], **entry["fields"]}
+
+    return sorted(fused.values(), key=lambda hit: hit["score"], reverse=True)
@@ -1,20 +1,31 @@
-from openai import OpenAI, AuthenticationError
-from typing import cast, List, Dict, Any
+from openai import OpenAI, AsyncOpenAI, AuthenticationError, RateLimitError, APITimeoutError, APIConnectionError
+from typing import cast, List, Dict, Any, AsyncIterator, Callable
 from dotenv import load_dotenv
 from logger import Logger
+import threading
+import asyncio
+import random
 import base64
 import json
+import time
 import os
 # from groq import Groq
 
 load_dotenv()
 log = Logger()
 IMAGE_FOLDER = os.environ.get("IMAGE_FOLDER")
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", "30.0"))
 
 class LLM:
     def __init__(self) -> None:
         try:
-            self.client = OpenAI(api_key=os.environ.get("LLM_API_KEY"))
+            # Retries are handled by __with_backoff__, client-side retries would multiply the attempts
+            self.client = OpenAI(api_key=os.environ.get("LLM_API_KEY"), max_retries=0)
+            # Used by the chat request path so a slow completion does not block the event loop. Ingestion runs on
+            # worker threads and keeps the sync client, so image description and summaries have no async variants
+            self.async_client = AsyncOpenAI(api_key=os.environ.get("LLM_API_KEY"), max_retries=0)
             # self.client = Groq(api_key=os.environ.get("LLM_API_KEY"))
             self.client.models.list()
             log.log_event("SYSTEM", "LLM API Connected")
@@ -157,6 +168,17 @@ class LLM:
         - The entire summary should only be the GIST of the entire document, to only provide context of the document to a LLM.
         """
 
+        self.system_prompt_ss = """
+        You are a professional document summarizer. You will be given one section of a longer PDF document. Your summary will later be merged with the summaries of the other sections.
+
+        Instructions:
+        - Summarize only the section provided, in a few concise paragraphs or bullet points.
+        - Keep the key purpose, rules, eligibility criteria, limits, amounts and named terms stated in the section.
+        - Eliminate repetition caused by overlapping text.
+        - Do NOT add an introduction or conclusion about the whole document.
+        - Do NOT include metadata like image or page numbers in your response.
+        """
+
         self.model_v = "gpt-4.1-mini-2025-04-14"
         # self.model_v = "llama-3.1-8b-instant"
         self.model_r = "gpt-4.1-mini-2025-04-14"
@@ -171,81 +193,135 @@ class LLM:
         self.temperature_i = 0
         self.temperature_s = 0.5
 
+        # System messages that start with the static prompt and the document descriptions, rebuilt only when those change
+        self.prompt_prefixes: Dict[str, tuple] = {}
+        self.usage: Dict[str, Dict[str, int]] = {}
+        self.usage_lock = threading.Lock()
+
     def __encode_image__(self, image_path):
         with open(image_path, "rb") as image_file:
             return base64.b64encode(image_file.read()).decode("utf-8")
 
-    def __format_RLLM_input__(self, document_context, user_input, vllm_classification, rag_ans, convo) -> str:
-        return f"[Context of the Documents]:\n{document_context}\n\n[User Input]:\n{user_input}\n\n[Validator LLM Classification]:\n{vllm_classification}\n\n[RAG Answer]:\n{rag_ans}\n\n[Conversational History]:\n{convo}"
-
-    def generate_image_description(self, context, image_path):
-        img_b64 = self.__encode_image__(image_path)
+    def __retry_after__(self, excp: Exception) -> float | None:
+        response = getattr(excp, "response", None)
+        if response is None:
+            return None
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_i,
-                temperature=self.temperature_i,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self.system_prompt_i
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": f"Describe the image with the following context: {context}"
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{img_b64}"
-                                }                                                       
-                            }
-                        ]
-                    }
-                ],
-            )
-        except Exception as e:
-            log.log_event("SYSTEM", f"RESPONSE FAILED - Image Description LLM - {e}")
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
             return None
-        
+
+    def __with_backoff__(self, request: Callable[[], Any], label: str) -> Any:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                return request()
+            except (RateLimitError, APITimeoutError, APIConnectionError) as e:
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+
+                # Prefer the provider's Retry-After, otherwise exponential backoff with jitter
+                delay = self.__retry_after__(e) or LLM_BACKOFF_BASE * (2 ** attempt)
+                delay = min(LLM_BACKOFF_MAX, delay + random.uniform(0, delay / 2))
+                log.log_event("SYSTEM", f"RATE LIMITED - {label} - retrying in {delay:.1f}s (attempt {attempt + 1}/{LLM_MAX_RETRIES})")
+                time.sleep(delay)
+
+    async def __async_with_backoff__(self, request: Callable[[], Any], label: str) -> Any:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                return await request()
+            except (RateLimitError, APITimeoutError, APIConnectionError) as e:
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+
+                delay = self.__retry_after__(e) or LLM_BACKOFF_BASE * (2 ** attempt)
+                delay = min(LLM_BACKOFF_MAX, delay + random.uniform(0, delay / 2))
+                log.log_event("SYSTEM", f"RATE LIMITED - {label} - retrying in {delay:.1f}s (attempt {attempt + 1}/{LLM_MAX_RETRIES})")
+                await asyncio.sleep(delay)
+
+    def __prompt_prefix__(self, kind: str, document_context: str) -> str:
+        cached = self.prompt_prefixes.get(kind)
+        if cached is not None and cached[0] == document_context:
+            return cached[1]
+
+        # Provider prompt caching matches on the longest identical prefix, so the per-request parts never go in here
+        if kind == "validator":
+            prefix = self.system_prompt_v + document_context
+        else:
+            prefix = f"{self.system_prompt_r}\n[Context of the Documents]:\n{document_context}"
+        self.prompt_prefixes[kind] = (document_context, prefix)
+        return prefix
+
+    def __record_usage__(self, usage, label: str) -> None:
+        if usage is None:
+            return
+
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        with self.usage_lock:
+            entry = self.usage.setdefault(label, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+            entry["calls"] += 1
+            entry["prompt_tokens"] += usage.prompt_tokens or 0
+            entry["cached_tokens"] += cached_tokens
+            entry["completion_tokens"] += usage.completion_tokens or 0
+
+    def usage_stats(self) -> dict:
+        with self.usage_lock:
+            return {
+                label: {**entry, "cached_ratio": round(entry["cached_tokens"] / entry["prompt_tokens"], 4) if entry["prompt_tokens"] else None}
+                for label, entry in self.usage.items()
+            }
+
+    def __response_text__(self, response, label: str) -> str | None:
         if response:
+            self.__record_usage__(getattr(response, "usage", None), label)
             return response.choices[0].message.content
         else:
-            log.log_event("SYSTEM", "NO RESPONSE GENERATED - Image Description LLM")
+            log.log_event("SYSTEM", f"NO RESPONSE GENERATED - {label}")
             return None
 
-    def generate_document_summary(self, text):
-        # for token in tokens:
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model_s,
-                temperature=self.temperature_s,
-                messages=[
+    def __image_description_messages__(self, context, image_path) -> List[Dict[str, Any]]:
+        img_b64 = self.__encode_image__(image_path)
+        return [
+            {
+                "role": "system",
+                "content": self.system_prompt_i
+            },
+            {
+                "role": "user",
+                "content": [
                     {
-                        "role": "system",
-                        "content": self.system_prompt_s
+                        "type": "text",
+                        "text": f"Describe the image with the following context: {context}"
                     },
                     {
-                        "role": "user",
-                        "content": text
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{img_b64}"
+                        }
                     }
-                ],
-            )
-        except Exception as e:
-            log.log_event("SYSTEM", f"RESPONSE FAILED - Document Summary LLM - {e}")
-            return None
-
-        if response:
-            return response.choices[0].message.content
-        else:
-            log.log_event("SYSTEM", "NO RESPONSE GENERATED - Document Summary LLM")
-            return None
-
-    def respond(self, user_input, user_image_path = None, rag_image_path = None):
-        content: list = [] 
+                ]
+            }
+        ]
+
+    def __summary_messages__(self, system_prompt, text) -> List[Dict[str, Any]]:
+        return [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": text
+            }
+        ]
+
+    def __responder_messages__(self, user_input, user_image_path = None, rag_image_path = None, document_context = None) -> List[Dict[str, Any]]:
+        system_prompt = self.system_prompt_r if document_context is None else self.__prompt_prefix__("responder", document_context)
+        if not (user_image_path or rag_image_path):
+            return self.__summary_messages__(system_prompt, user_input)
+
+        content: list = []
         content.append({"type": "text", "text": user_input})
 
         if user_image_path:
@@ -258,73 +334,136 @@ class LLM:
             content.append({"type": "text", "text": "Here is a system-retrieved image that may help answer the question:"})
             content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{rag_img_b64}"}})
 
+        return self.__summary_messages__(system_prompt, content)
+
+    def __validator_messages__(self, user_input, document_context, user_convo) -> List[Dict[str, Any]]:
+        return self.__summary_messages__(self.__prompt_prefix__("validator", document_context), f"[[Conversation History]]:\n{user_convo}\n[[User Input]]:\n{user_input}")
+
+    def __format_RLLM_input__(self, user_input, vllm_classification, rag_ans, convo) -> str:
+        # The document context is part of the system prefix, the rest runs from the slowest-changing part to the newest
+        return f"[Conversational History]:\n{convo}\n\n[RAG Answer]:\n{rag_ans}\n\n[Validator LLM Classification]:\n{vllm_classification}\n\n[User Input]:\n{user_input}"
+
+    def generate_image_description(self, context, image_path):
+        messages = self.__image_description_messages__(context, image_path)
+
         try:
-            if user_image_path or rag_image_path:
-                response = self.client.chat.completions.create(
-                    model=self.model_r,
-                    temperature=self.temperature_r,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": self.system_prompt_r
-                        },
-                        {
-                            "role": "user",
-                            "content": content
-                        }
-                    ],
-                )
-            else:
-                response = self.client.chat.completions.create(
-                    model=self.model_r,
-                    temperature=self.temperature_r,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": self.system_prompt_r
-                        },
-                        {
-                            "role": "user",
-                            "content": user_input
-                        }
-                    ],
-                )
+            response = self.__with_backoff__(lambda: self.client.chat.completions.create(
+                model=self.model_i,
+                temperature=self.temperature_i,
+                messages=messages,
+            ), label="Image Description LLM")
+        except Exception as e:
+            log.log_event("SYSTEM", f"RESPONSE FAILED - Image Description LLM - {e}")
+            return None
+
+        return self.__response_text__(response, "Image Description LLM")
+
+    def generate_document_summary(self, text):
+        try:
+            response = self.__with_backoff__(lambda: self.client.chat.completions.create(
+                model=self.model_s,
+                temperature=self.temperature_s,
+                messages=self.__summary_messages__(self.system_prompt_s, text),
+            ), label="Document Summary LLM")
+        except Exception as e:
+            log.log_event("SYSTEM", f"RESPONSE FAILED - Document Summary LLM - {e}")
+            return None
+
+        return self.__response_text__(response, "Document Summary LLM")
+
+    def generate_section_summary(self, text):
+        try:
+            response = self.__with_backoff__(lambda: self.client.chat.completions.create(
+                model=self.model_s,
+                temperature=self.temperature_s,
+                messages=self.__summary_messages__(self.system_prompt_ss, text),
+            ), label="Section Summary LLM")
+        except Exception as e:
+            log.log_event("SYSTEM", f"RESPONSE FAILED - Section Summary LLM - {e}")
+            return None
+
+        return self.__response_text__(response, "Section Summary LLM")
+
+    def merge_section_summaries(self, summaries: List[str]):
+        sections = "\n\n".join([f"[Section {i+1}]:\n{summary}" for i, summary in enumerate(summaries)])
+        return self.generate_document_summary(text=f"The following are summaries of consecutive sections of one document, in order:\n\n{sections}")
+
+    def respond(self, user_input, user_image_path = None, rag_image_path = None, document_context = None):
+        try:
+            messages = self.__responder_messages__(user_input, user_image_path, rag_image_path, document_context)
+            response = self.__with_backoff__(lambda: self.client.chat.completions.create(
+                model=self.model_r,
+                temperature=self.temperature_r,
+                messages=messages,
+            ), label="Responder LLM")
         except Exception as e:
             log.log_event("SYSTEM", f"RESPONSE FAILED - Responder LLM - {e}")
             return None
-        
-        if response:
-            return response.choices[0].message.content
-        else:
-            log.log_event("SYSTEM", "NO RESPONSE GENERATED - Responder LLM")
+
+        return self.__response_text__(response, "Responder LLM")
+
+    async def arespond(self, user_input, user_image_path = None, rag_image_path = None, document_context = None):
+        try:
+            messages = await asyncio.to_thread(self.__responder_messages__, user_input, user_image_path, rag_image_path, document_context)
+            response = await self.__async_with_backoff__(lambda: self.async_client.chat.completions.create(
+                model=self.model_r,
+                temperature=self.temperature_r,
+                messages=messages,
+            ), label="Responder LLM")
+        except Exception as e:
+            log.log_event("SYSTEM", f"RESPONSE FAILED - Responder LLM - {e}")
             return None
 
+        return self.__response_text__(response, "Responder LLM")
+
+    async def astream_respond(self, user_input, user_image_path = None, rag_image_path = None, document_context = None, report: Callable[[str], None] | None = None) -> AsyncIterator[str]:
+        try:
+            messages = await asyncio.to_thread(self.__responder_messages__, user_input, user_image_path, rag_image_path, document_context)
+            # Only opening the stream is retried, a retry after tokens were yielded would repeat them
+            stream = await self.__async_with_backoff__(lambda: self.async_client.chat.completions.create(
+                model=self.model_r,
+                temperature=self.temperature_r,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+            ), label="Responder LLM stream")
+            async for chunk in stream:
+                # Usage only arrives on the final chunk, which carries no choices
+                self.__record_usage__(getattr(chunk, "usage", None), "Responder LLM")
+                if chunk.choices and chunk.choices[0].finish_reason and report:
+                    report(chunk.choices[0].finish_reason)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            # Re-raised so the caller can tell the client the answer is incomplete
+            log.log_event("SYSTEM", f"RESPONSE FAILED - Responder LLM stream - {e}")
+            raise
+
     def validate(self, user_input, document_context, user_convo):
         try:
-            response = self.client.chat.completions.create(
+            response = self.__with_backoff__(lambda: self.client.chat.completions.create(
                 model=self.model_v,
                 temperature=self.temperature_v,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self.system_prompt_v + document_context
-                    },
-                    {
-                        "role": "user",
-                        "content": f"[[Conversation History]]:\n{user_convo}\n[[User Input]]:\n{user_input}"
-                    }
-                ],
-            )
+                messages=self.__validator_messages__(user_input, document_context, user_convo),
+            ), label="Validator LLM")
         except Exception as e:
             log.log_event("SYSTEM", f"RESPONSE FAILED - Validator LLM - {e}")
             return None
-        
-        if response:
-            return response.choices[0].message.content
-        else:
-            log.log_event("SYSTEM", "NO RESPONSE GENERATED - Validator LLM ")
+
+        return self.__response_text__(response, "Validator LLM")
+
+    async def avalidate(self, user_input, document_context, user_convo):
+        try:
+            response = await self.__async_with_backoff__(lambda: self.async_client.chat.completions.create(
+                model=self.model_v,
+                temperature=self.temperature_v,
+                messages=self.__validator_messages__(user_input, document_context, user_convo),
+            ), label="Validator LLM")
+        except Exception as e:
+            log.log_event("SYSTEM", f"RESPONSE FAILED - Validator LLM - {e}")
             return None
 
+        return self.__response_text__(response, "Validator LLM")
 
 ####################################################################
 ####################################################################
@@ -1,18 +1,28 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 # from apscheduler.schedulers.background import BackgroundScheduler
 from fastapi.responses import JSONResponse
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from document_handling import Document
+from ingestion import IngestionQueue, IngestionPipeline
+from clip_registry import clip_registry, CLIP_WARMUP
+from context_packer import ContextPacker, PackedContext
+from intent_classifier import IntentClassifier, Intent, INTENT_CLASSIFIER
+from answer_cache import AnswerCache
 from pydantic import BaseModel
 from database import DBHandler
 from dotenv import load_dotenv
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional, Tuple
 from logger import Logger
 from llm import LLM
 import mimetypes
+import asyncio
+import time
+import hashlib
+import uuid
 import os
 import json
 from blob import Blob
@@ -39,18 +49,32 @@ llm = LLM()
 doc = Document()
 log = Logger()
 blob = Blob()
+ingestion_queue = IngestionQueue()
+ingestion_pipeline = IngestionPipeline(doc=doc, db=db, llm=llm, blob=blob)
+context_packer = ContextPacker()
+intent_classifier = IntentClassifier()
+# Cached answers are tied to both the indexed chunks and the document descriptions in the prompt prefix
+answer_cache = AnswerCache(generation=lambda: (doc.query_cache.version, db.descriptions_version))
 
 DOC_FOLDER = os.environ.get("DOCUMENT_FOLDER", "documents")
 CHAT_IMG_FOLDER = os.environ.get("CHAT_IMG_FOLDER", "chat_images")
 IMAGE_FOLDER = os.environ.get("IMAGE_FOLDER", "images")
 LOG_FOLDER = os.environ.get("LOG_FOLDER", "logs")
 LOG_FILE = os.environ.get("LOG_FILE", "")
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(250 * 1024 * 1024)))
+DESCRIPTION_CACHE_TTL = float(os.environ.get("DESCRIPTION_CACHE_TTL", "300"))
+SPECULATIVE_RETRIEVAL = os.environ.get("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
 os.makedirs(DOC_FOLDER, exist_ok=True)
 os.makedirs(CHAT_IMG_FOLDER, exist_ok=True)
 os.makedirs(IMAGE_FOLDER, exist_ok=True)
 
 ALLOWED_EXTENSIONS = {".pdf", ".png"}
 
+speculation_stats = {"started": 0, "used": 0, "discarded": 0}
+description_cache = {"version": None, "expires": 0.0, "descriptions": []}
+background_tasks: set[asyncio.Task] = set()
+
 # def run_message_insertion():
 #     log.log_event("SYSTEM", f"Maintenance task ran at {datetime.now()}")
 #     if db.__aquire_lock__():
@@ -65,6 +89,33 @@ ALLOWED_EXTENSIONS = {".pdf", ".png"}
 # scheduler.add_job(run_message_insertion, 'cron', hour=5, minute=12)  # Runs every day at 2:00 AM
 # scheduler.start()
 
+async def save_upload_stream(file: UploadFile, partial_location: str) -> Tuple[str, int]:
+    sha256 = hashlib.sha256()
+    size_bytes = 0
+
+    # Stream to a partial file so an oversized or aborted upload never replaces a good copy
+    try:
+        with open(partial_location, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size_bytes += len(chunk)
+                if size_bytes > MAX_UPLOAD_BYTES:
+                    log.log_event("SYSTEM", f"[MAIN] Upload rejected, {file.filename} exceeds {MAX_UPLOAD_BYTES} bytes")
+                    raise HTTPException(status_code=413, detail=f"File exceeds the {MAX_UPLOAD_BYTES} byte upload limit")
+
+                sha256.update(chunk)
+                await run_in_threadpool(f.write, chunk)
+    except BaseException:
+        if os.path.exists(partial_location):
+            os.remove(partial_location)
+        raise
+
+    return sha256.hexdigest(), size_bytes
+
+@app.on_event("startup")
+def warmup_models():
+    if CLIP_WARMUP:
+        clip_registry.warmup()
+
 # Root URL
 @app.get("/")
 def read_root():
@@ -76,91 +127,240 @@ async def upload_document(file: UploadFile = File(...)):
     log.log_event("SYSTEM", "[MAIN] Starting document processing...")
     
     file_location = os.path.join(DOC_FOLDER, str(file.filename))
-    with open(file_location, "wb") as f:
-        content = await file.read()
-        f.write(content)
-    log.log_event("SYSTEM", "[MAIN] Document saved to local folder...")
-
-    blob.upload_file(service=blob.authenticate(), file_path=file_location, folder_name="Documents")
-    log.log_event("SYSTEM", "[MAIN] Document saved to blob...")
-
-    document_summary = doc.create_document_summary(llm=llm, document_path=file_location)
-    log.log_event("SYSTEM", "[MAIN] Document summary created...")
-
-    db.insert_document(path=file_location, description=document_summary, vectorized=True)
-    log.log_event("SYSTEM", "[MAIN] Document inserted in Database...")
+    # Each upload streams to its own partial file, two uploads of the same name never write to one file
+    partial_location = f"{file_location}.{uuid.uuid4().hex}.part"
+    content_hash, size_bytes = await save_upload_stream(file=file, partial_location=partial_location)
 
-    doc.upsert_document(document_path=file_location)
-    log.log_event("SYSTEM", "[MAIN] Document inserted in PineconeDB...")
-
-    document_images = doc.extract_images_with_context(document_path=file_location)
-    log.log_event("SYSTEM", "[MAIN] Images extracted from the document...")
+    # The running job reopens the file per page range, so it is only replaced once no job uses it. The swap
+    # happens under the queue lock, so a reindex or second upload cannot start in between
+    try:
+        job = ingestion_queue.submit(filename=str(file.filename), file_location=file_location, pipeline=ingestion_pipeline.run, content_hash=content_hash, size_bytes=size_bytes, exclusive=True, on_accept=lambda: os.replace(partial_location, file_location))
+    finally:
+        if os.path.exists(partial_location):
+            os.remove(partial_location)
+    if job is None:
+        log.log_event("SYSTEM", "[MAIN] /upload-document returned - status(409)")
+        raise HTTPException(status_code=409, detail="The document is being ingested, try again when the job has finished")
+    log.log_event("SYSTEM", "[MAIN] Document saved to local folder...")
 
-    if document_images:
-        # print('why isnt this working', document_images)
-        doc.embed_and_upsert_images(llm=llm, db=db, images=document_images)
-        log.log_event("SYSTEM", "[MAIN] Images inserted in PineconeDB...")
-    
     log.log_event("SYSTEM", "[MAIN] /upload-document API Returned")
-    return {
-        "status": "200 OK",
-        "message": "File saved successfully", 
-        "filename": file.filename
-    }
+    return JSONResponse(
+        status_code=202,
+        content={
+            "status": "202 Accepted",
+            "message": "File saved successfully and queued for ingestion", 
+            "filename": file.filename,
+            "job_id": job.job_id
+        }
+    )
 
-@app.post("/chat")
-# async def chat_endpoint(userID: int = Form(...), chatID: int = Form(...), text: str = Form(...), image: Optional[UploadFile] = File(None)):
-async def chat_endpoint(userID: int = Form(...), chatID: int = Form(...), text: str = Form(...)):
-    log.log_event("SYSTEM", "[MAIN] /chat API Called")
-    
-    response = ""
-    image_location = None
-    rag_img_ans = None
+@app.get("/ingestion-jobs/{job_id}")
+def get_ingestion_job(job_id: str):
+    log.log_event("SYSTEM", f"[MAIN] /ingestion-jobs/{job_id} API Called")
+    job = ingestion_queue.get(job_id)
+
+    if not job:
+        log.log_event("SYSTEM", f"[MAIN] /ingestion-jobs/{job_id} returned - status(404)")
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+
+    log.log_event("SYSTEM", f"[MAIN] /ingestion-jobs/{job_id} API Returned")
+    return job.to_dict()
+
+@app.get("/query-cache/stats")
+def get_query_cache_stats():
+    log.log_event("SYSTEM", "[MAIN] /query-cache/stats API Called")
+    return doc.query_cache.stats()
+
+@app.get("/speculation/stats")
+def get_speculation_stats():
+    log.log_event("SYSTEM", "[MAIN] /speculation/stats API Called")
+    started = speculation_stats["started"]
+    return {**speculation_stats, "hit_rate": round(speculation_stats["used"] / started, 4) if started else None}
+
+@app.get("/intent/stats")
+def get_intent_stats():
+    log.log_event("SYSTEM", "[MAIN] /intent/stats API Called")
+    return intent_classifier.stats()
+
+@app.get("/llm/usage")
+def get_llm_usage():
+    log.log_event("SYSTEM", "[MAIN] /llm/usage API Called")
+    return llm.usage_stats()
+
+@app.get("/answer-cache/stats")
+def get_answer_cache_stats():
+    log.log_event("SYSTEM", "[MAIN] /answer-cache/stats API Called")
+    return answer_cache.stats()
+
+@app.delete("/documents/{document_id}")
+def delete_document_endpoint(document_id: int):
+    log.log_event("SYSTEM", f"[MAIN] DELETE /documents/{document_id} API Called")
+    document = db.get_document(document_id)
+
+    if not document:
+        log.log_event("SYSTEM", f"[MAIN] DELETE /documents/{document_id} returned - status(404)")
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    # Re-embedding images other documents reuse can parse their PDFs and call the LLM, so the delete runs as a
+    # tracked job, refused while another job for the document is queued or running
+    job = ingestion_queue.submit(filename=document["name"], file_location=document["path"], pipeline=lambda job: ingestion_pipeline.delete(job, image_folder=IMAGE_FOLDER), document_id=document_id, delete=True, exclusive=True)
+    if job is None:
+        log.log_event("SYSTEM", f"[MAIN] DELETE /documents/{document_id} returned - status(409)")
+        raise HTTPException(status_code=409, detail="The document is being ingested, try again when the job has finished")
+
+    log.log_event("SYSTEM", f"[MAIN] DELETE /documents/{document_id} returned - status(202)")
+    return JSONResponse(
+        status_code=202,
+        content={
+            "status": "202 Accepted",
+            "message": "Document queued for deletion",
+            "document_id": document_id,
+            "job_id": job.job_id
+        }
+    )
 
-    # if image:
-    #     log.log_event("SYSTEM", f"[MAIN] User {userID} provided an image")
-    #     image_location = os.path.join(CHAT_IMG_FOLDER, str(image.filename))
-    #     blob.upload_file(service=blob.authenticate(), file_path=image_location, folder_name="ChatImages")
-    #     with open(image_location, "wb") as f:
-    #         content = await image.read()
-    #         f.write(content)
+@app.post("/documents/{document_id}/reindex")
+def reindex_document_endpoint(document_id: int):
+    log.log_event("SYSTEM", f"[MAIN] /documents/{document_id}/reindex API Called")
+    document = db.get_document(document_id)
+
+    if not document:
+        log.log_event("SYSTEM", f"[MAIN] /documents/{document_id}/reindex returned - status(404)")
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    if not os.path.exists(document["path"]):
+        log.log_event("SYSTEM", f"[MAIN] /documents/{document_id}/reindex returned - status(409)")
+        raise HTTPException(status_code=409, detail="The document file is no longer available locally, upload it again")
+
+    job = ingestion_queue.submit(filename=document["name"], file_location=document["path"], pipeline=ingestion_pipeline.run, document_id=document_id, reindex=True, exclusive=True)
+    if job is None:
+        log.log_event("SYSTEM", f"[MAIN] /documents/{document_id}/reindex returned - status(409)")
+        raise HTTPException(status_code=409, detail="The document is already being ingested")
+
+    log.log_event("SYSTEM", f"[MAIN] /documents/{document_id}/reindex returned - status(202)")
+    return JSONResponse(
+        status_code=202,
+        content={
+            "status": "202 Accepted",
+            "message": "Document queued for reindexing",
+            "document_id": document_id,
+            "job_id": job.job_id
+        }
+    )
 
-    db.add_message(chat_id=chatID, sender='user', message=text)
+async def get_descriptions() -> list[str]:
+    # Re-read only when a document changed in this process, the TTL covers changes made by other workers
+    version = db.descriptions_version
+    if description_cache["version"] != version or description_cache["expires"] < time.monotonic():
+        descriptions = await run_in_threadpool(db.get_doc_description_list)
+        if descriptions is None:
+            return description_cache["descriptions"]
+        description_cache.update(version=version, expires=time.monotonic() + DESCRIPTION_CACHE_TTL, descriptions=descriptions)
+    return description_cache["descriptions"]
+
+async def prepare_chat(chatID: int, text: str, userID: int) -> Tuple[str | None, str, PackedContext, List[str], str]:
+    await run_in_threadpool(db.add_message, chat_id=chatID, sender='user', message=text)
     # log.log_event("USER", msg=text, uid=userID, cid=1)
     # if db.__aquire_lock__():
     #     db.__release_lock__()
     # else:
     #     db.__insert_Write_Q__(user_id=userID, chat_id=1, sender='user', msg=text)
 
-    user_conversation, _ = db.get_chat_msgs(chat_id=chatID)
-    input_classification = llm.validate(user_input=text, document_context=db.get_all_doc_descriptions(), user_convo=user_conversation)
-    log.log_event("RESP", msg=f"[MAIN] Validator: {input_classification}", uid=userID, cid=1)
-
+    # Descriptions and history are packed into fixed token budgets instead of being sent whole
+    # DB and vector store clients are blocking, so they run in the threadpool while the LLM calls are awaited
+    _, messages = await run_in_threadpool(db.get_chat_msgs, chat_id=chatID)
+    descriptions = await get_descriptions()
+    context = context_packer.pack(descriptions=descriptions, passages=None, messages=messages or [])
+
+    # Clear greetings and questions are labelled locally, only uncertain inputs go to the validator LLM
+    # The current message is already stored, so anything beyond it is earlier conversation
+    has_history = len(messages or []) > 1
+    # Follow-ups mean different things in different chats, so cached answers are keyed on the earlier messages too
+    earlier = [[message["sender"], message["content"]] for message in (messages or [])[:-1]]
+    history_key = hashlib.sha256(json.dumps(earlier).encode("utf-8")).hexdigest()
+    intent = await run_in_threadpool(intent_classifier.classify, text, has_history=has_history) if INTENT_CLASSIFIER else Intent(label=None, confidence=0.0, source="llm")
+
+    # Most inputs are valid questions, so retrieval starts alongside the validator instead of after it
+    retrieval = None
+    if SPECULATIVE_RETRIEVAL and intent.label is None:
+        retrieval = asyncio.create_task(run_in_threadpool(doc.query_passages, user_query=text))
+        speculation_stats["started"] += 1
+
+    if intent.label is not None:
+        input_classification = intent.label
+    else:
+        input_classification = await llm.avalidate(user_input=text, document_context=context.document_context, user_convo=context.history)
+        await run_in_threadpool(intent_classifier.record, text, input_classification, intent, has_history=has_history)
+    log.log_event("RESP", msg=f"[MAIN] Validator: {input_classification} | source={intent.source}", uid=userID, cid=1)
+
+    if retrieval is not None and input_classification != "Valid RAG Question":
+        # The worker thread cannot be interrupted, its result is only discarded
+        retrieval.cancel()
+        retrieval.add_done_callback(lambda task: task.cancelled() or task.exception())
+        speculation_stats["discarded"] += 1
+        log.log_event("SYSTEM", f"[MAIN] Speculative retrieval discarded, {speculation_stats['used']}/{speculation_stats['started']} used")
+
+    chunk_ids: List[str] = []
     if input_classification == "Valid RAG Question":
-        rag_ans = doc.query_text(user_query=text)
-        # rag_img_ans = doc.query_images_with_text(query=text)      
-        rag_img_ans = None      
+        if retrieval is not None:
+            passages = await retrieval
+            speculation_stats["used"] += 1
+        else:
+            passages = await run_in_threadpool(doc.query_passages, user_query=text)
+        context = context_packer.pack(descriptions=descriptions, passages=passages, messages=messages or [])
+        chunk_ids = [chunk_id for passage in passages or [] for chunk_id in passage["ids"]]
+        # rag_img_ans = doc.query_images_with_text(query=text)
         # if rag_img_ans:
             # response = llm.respond(user_input=llm.__format_RLLM_input__(document_context=db.get_all_doc_descriptions(), user_input=text, vllm_classification=input_classification, rag_ans=rag_ans, convo=user_conversation), user_image_path=image_location, rag_image_path=os.path.join(IMAGE_FOLDER, rag_img_ans))
-        # else:
-        response = llm.respond(user_input=llm.__format_RLLM_input__(document_context=db.get_all_doc_descriptions(), user_input=text, vllm_classification=input_classification, rag_ans=rag_ans, convo=user_conversation), user_image_path='', rag_image_path='')
-        log.log_event("RESP", msg=response, uid=userID, cid=1)
+        responder_input = llm.__format_RLLM_input__(user_input=text, vllm_classification=input_classification, rag_ans=context.rag_answer, convo=context.history)
     else:
-        response = llm.respond(user_input=llm.__format_RLLM_input__(document_context=db.get_all_doc_descriptions(), user_input=text, vllm_classification=input_classification, rag_ans=None, convo=user_conversation), user_image_path=None, rag_image_path=None)
-        log.log_event("RESP", msg=response, uid=userID, cid=1)
+        responder_input = llm.__format_RLLM_input__(user_input=text, vllm_classification=input_classification, rag_ans=None, convo=context.history)
 
+    return input_classification, responder_input, context, chunk_ids, history_key
+
+async def save_bot_response(chatID: int, response: str | None, rag_img_ans: str | None = None) -> None:
     if response:
         if rag_img_ans:
-            db.add_message(chat_id=chatID, sender='bot', message=response + '\n\nimage:' + os.path.join(IMAGE_FOLDER, rag_img_ans))
+            await run_in_threadpool(db.add_message, chat_id=chatID, sender='bot', message=response + '\n\nimage:' + os.path.join(IMAGE_FOLDER, rag_img_ans))
         else:
-            db.add_message(chat_id=chatID, sender='bot', message=response)
+            await run_in_threadpool(db.add_message, chat_id=chatID, sender='bot', message=response)
     else:
-        db.add_message(chat_id=chatID, sender='bot', message='Oops! Something went wrong.')
+        await run_in_threadpool(db.add_message, chat_id=chatID, sender='bot', message='Oops! Something went wrong.')
     # if db.__aquire_lock__():
     #     db.__release_lock__()
     # else:
     #     db.__insert_Write_Q__(user_id=userID, chat_id=1, sender='bot', msg=response)
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat")
+# async def chat_endpoint(userID: int = Form(...), chatID: int = Form(...), text: str = Form(...), image: Optional[UploadFile] = File(None)):
+async def chat_endpoint(userID: int = Form(...), chatID: int = Form(...), text: str = Form(...)):
+    log.log_event("SYSTEM", "[MAIN] /chat API Called")
+    
+    response = ""
+    image_location = None
+    rag_img_ans = None
+
+    # if image:
+    #     log.log_event("SYSTEM", f"[MAIN] User {userID} provided an image")
+    #     image_location = os.path.join(CHAT_IMG_FOLDER, str(image.filename))
+    #     blob.upload_file(service=blob.authenticate(), file_path=image_location, folder_name="ChatImages")
+    #     with open(image_location, "wb") as f:
+    #         content = await image.read()
+    #         f.write(content)
+
+    input_classification, responder_input, context, chunk_ids, history_key = await prepare_chat(chatID=chatID, text=text, userID=userID)
+    # A paraphrase of an answered question that retrieves the same chunks reuses the stored answer
+    response, generation = answer_cache.get(query=text, chunk_ids=chunk_ids, context_key=history_key)
+    cached = response is not None
+    if not cached:
+        response = await llm.arespond(user_input=responder_input, user_image_path=None, rag_image_path=None, document_context=context.document_context)
+        answer_cache.put(query=text, chunk_ids=chunk_ids, answer=response, generation=generation, context_key=history_key)
+    log.log_event("RESP", msg=response, uid=userID, cid=1)
+    await save_bot_response(chatID=chatID, response=response, rag_img_ans=rag_img_ans)
+
     log.log_event("SYSTEM", "[MAIN] /chat API Returned")
     return {
         "status": "200 OK",
@@ -168,9 +368,57 @@ async def chat_endpoint(userID: int = Form(...), chatID: int = Form(...), text:
         "text": text,
         "class": input_classification,
         "response": response,
-        "image_answer": [rag_img_ans] if rag_img_ans else None
+        "image_answer": [rag_img_ans] if rag_img_ans else None,
+        "context_tokens": context.token_counts,
+        "cached_answer": cached
     }
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(userID: int = Form(...), chatID: int = Form(...), text: str = Form(...)):
+    log.log_event("SYSTEM", "[MAIN] /chat/stream API Called")
+
+    async def events():
+        parts = []
+        saved = False
+        try:
+            input_classification, responder_input, context, chunk_ids, history_key = await prepare_chat(chatID=chatID, text=text, userID=userID)
+            # The class goes out before generation starts so the client can render while the responder runs
+            yield sse_event("class", {"class": input_classification, "context_tokens": context.token_counts})
+
+            response, generation = answer_cache.get(query=text, chunk_ids=chunk_ids, context_key=history_key)
+            cached = response is not None
+            if cached:
+                parts.append(response)
+                yield sse_event("token", {"text": response})
+            else:
+                finish_reasons = []
+                async for token in llm.astream_respond(user_input=responder_input, user_image_path=None, rag_image_path=None, document_context=context.document_context, report=finish_reasons.append):
+                    parts.append(token)
+                    yield sse_event("token", {"text": token})
+
+                response = "".join(parts) or None
+                # A stream that broke off or hit the token limit leaves a partial answer, which is never cached
+                if finish_reasons == ["stop"]:
+                    answer_cache.put(query=text, chunk_ids=chunk_ids, answer=response, generation=generation, context_key=history_key)
+            log.log_event("RESP", msg=response, uid=userID, cid=1)
+            await save_bot_response(chatID=chatID, response=response)
+            saved = True
+
+            log.log_event("SYSTEM", "[MAIN] /chat/stream API Returned")
+            yield sse_event("done", {"status": "200 OK", "userID": userID, "text": text, "class": input_classification, "response": response, "image_answer": None, "cached_answer": cached})
+        except Exception as excp:
+            # The 200 headers are already sent, so failures are reported in-band
+            log.log_event("SYSTEM", f"[MAIN] /chat/stream failed - {excp}")
+            yield sse_event("error", {"status": "500 Internal Server Error", "message": "Failed to generate a response"})
+        finally:
+            if not saved:
+                # A disconnect cancels this generator, so the partial answer is saved from a separate task
+                task = asyncio.create_task(save_bot_response(chatID=chatID, response="".join(parts) or None))
+                background_tasks.add(task)
+                task.add_done_callback(background_tasks.discard)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 class ChatMessage(BaseModel):
     message_id: int
     sender: str
@@ -188,7 +436,7 @@ def get_user_chats(user_id: int):
 async def get_chat(chat_id: int):
     log.log_event("SYSTEM", f"[MAIN] /getchatmessage/{chat_id} API Called")
     
-    _, chatmsgs = db.get_chat_msgs(chat_id=chat_id)
+    _, chatmsgs = await run_in_threadpool(db.get_chat_msgs, chat_id=chat_id)
 
     log.log_event("SYSTEM", f"[MAIN] /getchatmessage/{chat_id} API Returned")
     return chatmsgs
@@ -226,7 +474,7 @@ async def get_file(filename: str, inline: bool = False):
 async def authenticate_endpoint(username: str = Form(...), password: str = Form(...)):
     log.log_event("SYSTEM", "[MAIN] /authenticate_endpoint called")
     try:
-        user: dict | None  = db.authenticate_user(username=username, password=password)
+        user: dict | None  = await run_in_threadpool(db.authenticate_user, username=username, password=password)
         
         if user:
             log.log_event("SYSTEM", "[MAIN] /authenticate_endpoint returned - status(200)")
@@ -261,7 +509,7 @@ async def authenticate_endpoint(username: str = Form(...), password: str = Form(
 async def deactivate_user_endpoint(userID: int = Form(...)):
     log.log_event("SYSTEM", "[MAIN] /deactivate_user_endpoint called")
     try:
-        user = db.deactivate_user(user_id=userID)
+        user = await run_in_threadpool(db.deactivate_user, user_id=userID)
 
         if user:
             log.log_event("SYSTEM", "[MAIN] /deactivate_user_endpoint returned - status(200)")
@@ -295,7 +543,7 @@ async def deactivate_user_endpoint(userID: int = Form(...)):
 async def activate_user_endpoint(userID: int = Form(...)):
     log.log_event("SYSTEM", "[MAIN] /activate_user_endpoint called")
     try:
-        user = db.activate_user(user_id=userID)
+        user = await run_in_threadpool(db.activate_user, user_id=userID)
 
         if user:
             log.log_event("SYSTEM", "[MAIN] /activate_user_endpoint returned - status(200)")
@@ -329,7 +577,7 @@ async def activate_user_endpoint(userID: int = Form(...)):
 async def refresh_logs_endpoint():
     log.log_event("SYSTEM", "[MAIN] /refresh_logs_endpoint called")
     try:
-        log_file = blob.upload_file(blob.authenticate(), file_path=os.path.join(LOG_FOLDER, LOG_FILE), folder_name="Logs")
+        log_file = await run_in_threadpool(lambda: blob.upload_file(blob.authenticate(), file_path=os.path.join(LOG_FOLDER, LOG_FILE), folder_name="Logs"))
 
         if log_file:
             log.log_event("SYSTEM", "[MAIN] /refresh_logs_endpoint returned - status(200)")
@@ -365,7 +613,7 @@ async def get_user_info_endpoint(userID: int):
     log.log_event("SYSTEM", "[MAIN] /get_user_info_endpoint called")
 
     try:
-        user = db.get_user_info(user_id=userID)
+        user = await run_in_threadpool(db.get_user_info, user_id=userID)
 
         if user:
             enc_user = jsonable_encoder(user)
@@ -398,7 +646,7 @@ async def get_user_info_endpoint(userID: int):
 async def get_all_users_endpoint():
     log.log_event("SYSTEM", "[MAIN] /get_all_users_endpoint called")
     try:
-        user = db.get_all_users_info()
+        user = await run_in_threadpool(db.get_all_users_info)
 
         if user:
             print('1')
@@ -433,7 +681,7 @@ async def get_all_users_endpoint():
 async def create_user_endpoint(username: str = Form(...), password: str = Form(...), role: str = Form(...)):
     log.log_event("SYSTEM", "[MAIN] /create_user_endpoint called")
     try:
-        user = db.create_user(username=username, password=password, role=role)
+        user = await run_in_threadpool(db.create_user, username=username, password=password, role=role)
 
         if user:
             log.log_event("SYSTEM", "[MAIN] /create_user_endpoint returned - status(200)")
@@ -467,9 +715,9 @@ async def create_chat_endpoint(userID: int = Form(...), chat_name: Optional[str]
     try:
         log.log_event("SYSTEM", "[MAIN] /create_chat_endpoint called")
         if chat_name:
-            chat = db.create_chat(user_id=userID, chat_name=chat_name)
+            chat = await run_in_threadpool(db.create_chat, user_id=userID, chat_name=chat_name)
         else:
-            chat = db.create_chat(user_id=userID)
+            chat = await run_in_threadpool(db.create_chat, user_id=userID)
 
         if chat:
             log.log_event("SYSTEM", "[MAIN] /create_chat_endpoint returned - status(200)")
@@ -506,10 +754,10 @@ async def change_user_details_endpoint(userID: int = Form(...), role: str | None
     
     try:
         if role:
-            user_role = db.change_role(user_id=userID, role=role)
+            user_role = await run_in_threadpool(db.change_role, user_id=userID, role=role)
 
         if password:
-            user_password = db.change_password(user_id=userID, password=password)
+            user_password = await run_in_threadpool(db.change_password, user_id=userID, password=password)
 
         if user_role or user_password:
             return JSONResponse(
@@ -0,0 +1,155 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Callable, Iterable, Iterator, List
+from collections import deque
+from dotenv import load_dotenv
+from logger import Logger
+import threading
+import queue
+import os
+
+load_dotenv()
+log = Logger()
+
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "16"))
+
+END_OF_STREAM = object()
+
+class PipelineCancelled(Exception):
+    pass
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def parallel_map(fn: Callable[[Any], Any], items: Iterable[Any], workers: int) -> Iterator[Any]:
+    # Keeps at most `workers` calls in flight and yields results in input order
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="pipeline-map") as executor:
+        pending: deque[Future] = deque()
+        for item in items:
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fn, item))
+        while pending:
+            yield pending.popleft().result()
+
+class Channel:
+    def __init__(self, pipeline: "StreamPipeline", maxsize: int) -> None:
+        self.pipeline = pipeline
+        self.queue: queue.Queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item: Any) -> None:
+        # Blocks while the consumer is behind (backpressure) but gives up once the pipeline is cancelled
+        while True:
+            if self.pipeline.cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self) -> None:
+        self.put(END_OF_STREAM)
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            if self.pipeline.cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                item = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is END_OF_STREAM:
+                return
+            yield item
+
+class StreamPipeline:
+    def __init__(self, name: str, queue_size: int = PIPELINE_QUEUE_SIZE, on_progress: Callable[[str, str, int, str | None], None] | None = None) -> None:
+        self.name = name
+        self.queue_size = queue_size
+        self.on_progress = on_progress
+        self.cancelled = threading.Event()
+        self.errors: List[Exception] = []
+        self.threads: List[threading.Thread] = []
+
+    def __report__(self, name: str, status: str, items: int, error: str | None = None) -> None:
+        if self.on_progress:
+            self.on_progress(name, status, items, error)
+
+    def __count__(self, name: str, items: Iterable[Any], counter: List[int]) -> Iterator[Any]:
+        for item in items:
+            counter[0] += 1
+            self.__report__(name, "running", counter[0])
+            yield item
+
+    def __start__(self, name: str, body: Callable[[List[int]], None]) -> None:
+        def worker() -> None:
+            counter = [0]
+            self.__report__(name, "running", 0)
+            try:
+                body(counter)
+            except PipelineCancelled:
+                self.__report__(name, "cancelled", counter[0])
+                return
+            except Exception as excp:
+                log.log_event("SYSTEM", f"[PIPELINE] {self.name}/{name} failed. {excp}")
+                self.errors.append(excp)
+                self.cancelled.set()
+                self.__report__(name, "failed", counter[0], str(excp))
+                return
+            self.__report__(name, "completed", counter[0])
+
+        thread = threading.Thread(target=worker, name=f"{self.name}-{name}", daemon=True)
+        self.threads.append(thread)
+        thread.start()
+
+    def source(self, name: str, items: Iterable[Any]) -> Channel:
+        output = Channel(self, self.queue_size)
+
+        def body(counter: List[int]) -> None:
+            for item in self.__count__(name, items, counter):
+                output.put(item)
+            output.close()
+
+        self.__start__(name, body)
+        return output
+
+    def stage(self, name: str, transform: Callable[[Iterator[Any]], Iterable[Any]], inputs: Channel) -> Channel:
+        output = Channel(self, self.queue_size)
+
+        def body(counter: List[int]) -> None:
+            for item in self.__count__(name, transform(iter(inputs)), counter):
+                output.put(item)
+            output.close()
+
+        self.__start__(name, body)
+        return output
+
+    def tee(self, name: str, inputs: Channel, count: int) -> List[Channel]:
+        outputs = [Channel(self, self.queue_size) for _ in range(count)]
+
+        def body(counter: List[int]) -> None:
+            for item in self.__count__(name, inputs, counter):
+                for output in outputs:
+                    output.put(item)
+            for output in outputs:
+                output.close()
+
+        self.__start__(name, body)
+        return outputs
+
+    def sink(self, name: str, consume: Callable[[Iterator[Any]], None], inputs: Channel) -> None:
+        self.__start__(name, lambda counter: consume(self.__count__(name, inputs, counter)))
+
+    def run(self) -> None:
+        for thread in self.threads:
+            thread.join()
+
+        if self.errors:
+            raise self.errors[0]
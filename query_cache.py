@@ -0,0 +1,82 @@
+from typing import Any, Callable, Hashable, Tuple
+from collections import OrderedDict
+from dotenv import load_dotenv
+from logger import Logger
+import threading
+import time
+import os
+import re
+
+load_dotenv()
+log = Logger()
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "600"))
+
+def normalize_query(text: str) -> str:
+    # Case, spacing and trailing punctuation do not change what the vector store returns in any useful way
+    return re.sub(r"\s+", " ", text).strip().lower().rstrip("?.! ")
+
+class QueryCache:
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        if self.maxsize <= 0:
+            return compute()
+
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            version = self.version
+
+        value = compute()
+
+        with self.lock:
+            # A result computed while the corpus changed may already be stale, so it is not kept
+            if version == self.version:
+                self.entries[key] = (time.monotonic() + self.ttl, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+
+        return value
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.version += 1
+            self.invalidations += 1
+        log.log_event("SYSTEM", "[QUERY CACHE] Invalidated after a corpus change")
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "corpus_version": self.version,
+            }
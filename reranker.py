@@ -0,0 +1,123 @@
+from typing import Any, Callable, Dict, List, Tuple
+from lexical_index import tokenize
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+RERANK_PRIOR_WEIGHT = float(os.environ.get("RERANK_PRIOR_WEIGHT", "0.3"))
+
+class CrossScorer:
+    """Scores each passage against the query directly instead of through separate embeddings.
+
+    Features are idf-weighted term coverage, query bigrams found in the passage and how tightly
+    the matched terms cluster. It runs locally in microseconds per passage."""
+
+    def __init__(self, idfs: Callable[[List[str]], Dict[str, float]] | None = None) -> None:
+        self.idfs = idfs or (lambda terms: {term: 1.0 for term in terms})
+
+    def __proximity__(self, positions: Dict[str, List[int]]) -> float:
+        # Smallest window that contains at least one occurrence of every matched term
+        events = sorted((position, term) for term, term_positions in positions.items() for position in term_positions)
+        if len(positions) <= 1:
+            return 1.0 if positions else 0.0
+
+        best = None
+        counts: Dict[str, int] = {}
+        left = 0
+        for right, (position, term) in enumerate(events):
+            counts[term] = counts.get(term, 0) + 1
+            while len(counts) == len(positions):
+                width = position - events[left][0] + 1
+                best = width if best is None else min(best, width)
+                left_term = events[left][1]
+                counts[left_term] -= 1
+                if not counts[left_term]:
+                    del counts[left_term]
+                left += 1
+
+        return len(positions) / best if best else 0.0
+
+    def score(self, query: str, passages: List[str]) -> List[float]:
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        if not query_terms:
+            return [0.0] * len(passages)
+
+        weights = self.idfs(query_terms)
+        total_weight = sum(weights.values()) or 1.0
+        query_bigrams = set(zip(query_terms, query_terms[1:]))
+        scores = []
+
+        for passage in passages:
+            terms = tokenize(passage)
+            positions: Dict[str, List[int]] = {}
+            for position, term in enumerate(terms):
+                if term in weights:
+                    positions.setdefault(term, []).append(position)
+
+            coverage = sum(weights[term] for term in positions) / total_weight
+            bigrams = len(query_bigrams & set(zip(terms, terms[1:]))) / len(query_bigrams) if query_bigrams else 0.0
+            scores.append(0.5 * coverage + 0.3 * bigrams + 0.2 * self.__proximity__(positions))
+
+        return scores
+
+def rerank(query: str, hits: List[Dict[str, Any]], scorer: CrossScorer, prior_weight: float = RERANK_PRIOR_WEIGHT) -> List[Dict[str, Any]]:
+    if not hits:
+        return []
+
+    # The first-stage rank is kept as a prior so the cross score breaks ties rather than overriding retrieval
+    cross = scorer.score(query, [hit["fields"].get("text", "") for hit in hits])
+    reranked = [
+        {**hit, "score": (1 - prior_weight) * cross_score + prior_weight * (1.0 - rank / len(hits))}
+        for rank, (hit, cross_score) in enumerate(zip(hits, cross))
+    ]
+    return sorted(reranked, key=lambda hit: hit["score"], reverse=True)
+
+def stitch(left: str, right: str, min_overlap: int = 16) -> str:
+    # Adjacent chunks share their overlap tokens verbatim, so the longest suffix of one that prefixes the other is dropped
+    anchor = right[:min_overlap]
+    position = left.find(anchor) if len(anchor) == min_overlap else -1
+    while position != -1:
+        if right.startswith(left[position:]):
+            return left + right[len(left) - position:]
+        position = left.find(anchor, position + 1)
+    return f"{left} {right}"
+
+def chunk_key(fields: Dict[str, Any]) -> Tuple[Any, Any] | None:
+    if fields.get("chunk_no") is None or fields.get("page_no") is None:
+        return None
+    return (fields.get("document_id", fields.get("source")), fields["page_no"])
+
+def merge_passages(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merges hits that are consecutive chunks of the same page into one passage.
+
+    A passage keeps the best score of its chunks. Hits without chunk ordinals (ingested before
+    ordinals were stored) are passed through on their own."""
+    groups: Dict[Tuple[Any, Any], List[Dict[str, Any]]] = {}
+    passages: List[Dict[str, Any]] = []
+
+    for hit in hits:
+        key = chunk_key(hit["fields"])
+        if key is None:
+            passages.append({"ids": [hit["id"]], "score": hit["score"], "fields": dict(hit["fields"])})
+        else:
+            groups.setdefault(key, []).append(hit)
+
+    for group in groups.values():
+        group = sorted({hit["id"]: hit for hit in group}.values(), key=lambda hit: hit["fields"]["chunk_no"])
+        current = None
+
+        for hit in group:
+            fields = hit["fields"]
+            if current is not None and fields["chunk_no"] <= current["fields"]["chunk_end"] + 1:
+                current["fields"]["text"] = stitch(current["fields"]["text"], fields.get("text", ""))
+                current["fields"]["chunk_end"] = fields["chunk_no"]
+                current["fields"]["token_end"] = fields.get("token_end")
+                current["ids"].append(hit["id"])
+                current["score"] = max(current["score"], hit["score"])
+                continue
+
+            current = {"ids": [hit["id"]], "score": hit["score"], "fields": {**fields, "chunk_end": fields["chunk_no"]}}
+            passages.append(current)
+
+    return sorted(passages, key=lambda passage: passage["score"], reverse=True)
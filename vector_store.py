@@ -0,0 +1,540 @@
+from typing import cast, Any, Callable, Dict, Iterator, List, Set, Tuple
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from journal import Journal
+from pinecone import Pinecone
+from logger import Logger
+import numpy as np
+import threading
+import hashlib
+import heapq
+import math
+import os
+import re
+
+load_dotenv()
+log = Logger()
+
+VECTOR_STORE = os.environ.get("VECTOR_STORE", "pinecone").lower()
+VECTOR_STORE_PATH = os.environ.get("VECTOR_STORE_PATH", "vector_store")
+LOCAL_TEXT_DIMENSION = int(os.environ.get("LOCAL_TEXT_DIMENSION", "768"))
+LOCAL_ANN_MIN_VECTORS = int(os.environ.get("LOCAL_ANN_MIN_VECTORS", "20000"))
+LOCAL_ANN_NEIGHBORS = int(os.environ.get("LOCAL_ANN_NEIGHBORS", "16"))
+LOCAL_ANN_EF_CONSTRUCTION = int(os.environ.get("LOCAL_ANN_EF_CONSTRUCTION", "100"))
+LOCAL_ANN_EF_SEARCH = int(os.environ.get("LOCAL_ANN_EF_SEARCH", "64"))
+
+class VectorStore(ABC):
+    """Upsert, search and delete vectors grouped into namespaces.
+
+    Records are dicts with an "_id", an optional "values" vector and flat metadata fields.
+    Search results are dicts with "id", "score" and "fields", fetch returns the fields by id."""
+
+    @abstractmethod
+    def upsert(self, namespace: str, records: List[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    def search(self, namespace: str, top_k: int, vector: List[float] | None = None, text: str | None = None, fields: List[str] | None = None) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def fetch(self, namespace: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def delete(self, namespace: str, ids: List[str]) -> None:
+        ...
+
+    @abstractmethod
+    def list_ids(self, namespace: str, prefix: str = "") -> List[str]:
+        ...
+
+    @abstractmethod
+    def delete_namespace(self, namespace: str) -> None:
+        ...
+
+class PineconeVectorStore(VectorStore):
+    def __init__(self, index, integrated_embedding: bool = False, delete_batch_size: int = 1000) -> None:
+        self.index = index
+        self.integrated_embedding = integrated_embedding
+        self.delete_batch_size = delete_batch_size
+
+    def upsert(self, namespace: str, records: List[Dict[str, Any]]) -> None:
+        # Indexes with integrated embedding embed the text field server side
+        if self.integrated_embedding:
+            self.index.upsert_records(namespace=namespace, records=records)
+            return
+
+        self.index.upsert(
+            namespace=namespace,
+            vectors=[
+                (record["_id"], record["values"], {key: value for key, value in record.items() if key not in ("_id", "values")})
+                for record in records
+            ]
+        )
+
+    def search(self, namespace: str, top_k: int, vector: List[float] | None = None, text: str | None = None, fields: List[str] | None = None) -> List[Dict[str, Any]]:
+        if self.integrated_embedding:
+            results = self.index.search(namespace=namespace, query={"inputs": {"text": text}, "top_k": top_k}, fields=fields)
+            return [{"id": hit["_id"], "score": hit["_score"], "fields": dict(hit["fields"])} for hit in results["result"]["hits"]]
+
+        results = self.index.query(namespace=namespace, vector=vector, top_k=top_k, include_metadata=True)
+        return [
+            {"id": match["id"], "score": match["score"], "fields": {key: value for key, value in (match.get("metadata") or {}).items() if fields is None or key in fields}}
+            for match in results["matches"]
+        ]
+
+    def fetch(self, namespace: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        results = self.index.fetch(ids=ids, namespace=namespace)
+        return {vector_id: dict(vector.metadata or {}) for vector_id, vector in results.vectors.items()}
+
+    def delete(self, namespace: str, ids: List[str]) -> None:
+        for i in range(0, len(ids), self.delete_batch_size):
+            self.index.delete(ids=ids[i:i + self.delete_batch_size], namespace=namespace)
+
+    def list_ids(self, namespace: str, prefix: str = "") -> List[str]:
+        # Only serverless indexes support listing
+        return [vector_id for page in self.index.list(prefix=prefix, namespace=namespace) for vector_id in page]
+
+    def delete_namespace(self, namespace: str) -> None:
+        self.index.delete(delete_all=True, namespace=namespace)
+
+class HashingEmbedder:
+    """Feature-hashed unigrams and bigrams, for running the local store without an embedding service.
+
+    Matches are lexical only, so retrieval quality is below the hosted model."""
+
+    def __init__(self, dimension: int = LOCAL_TEXT_DIMENSION) -> None:
+        self.dimension = dimension
+
+    def __bucket__(self, feature: str) -> Tuple[int, float]:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dimension, 1.0 if value >> 63 else -1.0
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+
+        for row, text in enumerate(texts):
+            words = re.findall(r"\w+", text.lower())
+            counts: Dict[str, int] = {}
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                counts[feature] = counts.get(feature, 0) + 1
+
+            for feature, count in counts.items():
+                bucket, sign = self.__bucket__(feature)
+                vectors[row, bucket] += sign * (1.0 + math.log(count))
+
+        return vectors
+
+class SmallWorldGraph:
+    """A navigable small-world graph over the rows of a normalized vector matrix, rows whose id is None are deleted."""
+
+    def __init__(self, vectors: Any, ids: List[str | None], neighbors: int = LOCAL_ANN_NEIGHBORS) -> None:
+        self.vectors = vectors
+        self.ids = ids
+        self.neighbors = neighbors
+        self.graph: Any = np.full((len(ids), neighbors), -1, dtype=np.int32)
+        self.entry = -1
+
+    def __similarities__(self, query: np.ndarray, slots) -> np.ndarray:
+        return self.vectors[slots] @ query
+
+    def __graph_search__(self, query: np.ndarray, ef: int) -> List[Tuple[float, int]]:
+        if self.entry < 0:
+            return []
+
+        visited = {self.entry}
+        entry_score = float(self.vectors[self.entry] @ query)
+        candidates = [(-entry_score, self.entry)]
+        best = [(entry_score, self.entry)]
+
+        # Best-first beam search: expand the closest unexpanded node until it is worse than the ef-th best found
+        while candidates:
+            negative_score, slot = heapq.heappop(candidates)
+            if len(best) >= ef and -negative_score < best[0][0]:
+                break
+
+            neighbors = [int(n) for n in self.graph[slot] if n >= 0 and int(n) not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+
+            for neighbor, score in zip(neighbors, self.__similarities__(query, neighbors)):
+                score = float(score)
+                if len(best) < ef or score > best[0][0]:
+                    heapq.heappush(candidates, (-score, neighbor))
+                    heapq.heappush(best, (score, neighbor))
+                    if len(best) > ef:
+                        heapq.heappop(best)
+
+        return sorted(best, reverse=True)
+
+    def __link__(self, slot: int, ef: int) -> None:
+        if self.entry < 0 or self.entry == slot:
+            self.entry = slot
+            return
+
+        query = self.vectors[slot]
+        candidates = [(score, other) for score, other in self.__graph_search__(query, ef) if other != slot and self.ids[other] is not None]
+        chosen = [other for _, other in candidates[:self.neighbors]]
+
+        self.graph[slot] = -1
+        self.graph[slot, :len(chosen)] = chosen
+
+        for other in chosen:
+            row = [int(n) for n in self.graph[other] if n >= 0 and int(n) != slot]
+            if len(row) < self.neighbors:
+                row.append(slot)
+            else:
+                # Keep the closest neighbours when the row is full
+                row.append(slot)
+                scores = self.__similarities__(self.vectors[other], row)
+                row = [row[i] for i in np.argsort(-scores)[:self.neighbors]]
+            self.graph[other] = -1
+            self.graph[other, :len(row)] = row
+
+    def build(self, ef: int = LOCAL_ANN_EF_CONSTRUCTION) -> None:
+        for slot, vector_id in enumerate(self.ids):
+            if vector_id is not None:
+                self.__link__(slot, ef)
+
+class LocalNamespace(SmallWorldGraph):
+    """One namespace of the local store: a flat float32 matrix plus a navigable small-world graph, both memory mapped.
+
+    Deleted slots are tombstoned and stay traversable until the namespace is compacted. Vectors and graph rows are
+    written straight to the shared maps, ids and metadata go through a journal so a batch does not rewrite them all."""
+
+    def __init__(self, directory: str, neighbors: int = LOCAL_ANN_NEIGHBORS) -> None:
+        self.directory = directory
+        self.neighbors = neighbors
+        self.state_path = os.path.join(directory, "state.json")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.graph_path = os.path.join(directory, "graph.i32")
+        os.makedirs(directory, exist_ok=True)
+
+        self.dimension: int | None = None
+        self.capacity = 0
+        self.count = 0
+        self.entry = -1
+        self.linked = False
+        self.ids: List[str | None] = []
+        self.metadata: List[Dict[str, Any] | None] = []
+        self.slots: Dict[str, int] = {}
+        self.vectors: Any = None
+        self.graph: Any = None
+        self.journal = Journal(self.state_path, os.path.join(directory, "state.journal"))
+        self.changes: Dict[str, list] = {"upsert": [], "delete": []}
+        self.rewritten = False
+
+    def __load__(self) -> None:
+        state = self.journal.load_checkpoint() or {"dimension": None, "capacity": 0, "count": 0, "entry": -1, "linked": False, "ids": [], "metadata": []}
+        self.dimension = state["dimension"]
+        self.capacity = state["capacity"]
+        self.count = state["count"]
+        self.entry = state["entry"]
+        self.linked = state["linked"]
+        self.ids = state["ids"]
+        self.metadata = state["metadata"]
+        self.slots = {vector_id: slot for slot, vector_id in enumerate(self.ids) if vector_id is not None}
+        self.vectors = self.graph = None
+        self.__map__()
+
+    def refresh(self) -> None:
+        # Catches up with batches written by other workers, call with the journal lock held
+        reset, entries = self.journal.read()
+        if reset:
+            self.__load__()
+        for entry in entries:
+            self.__apply__(entry)
+
+    def __apply__(self, entry: Dict[str, Any]) -> None:
+        self.__forget__(entry["delete"])
+        for slot, vector_id, fields in entry["upsert"]:
+            if slot < len(self.ids):
+                self.ids[slot] = vector_id
+                self.metadata[slot] = fields
+            else:
+                self.ids.append(vector_id)
+                self.metadata.append(fields)
+            self.slots[vector_id] = slot
+
+        # Counts only grow between checkpoints, a compaction always writes one
+        self.dimension = entry["dimension"]
+        self.count = max(self.count, entry["count"])
+        self.entry = entry["entry"]
+        self.linked = self.linked or entry["linked"]
+        if entry["capacity"] > self.capacity:
+            self.capacity = entry["capacity"]
+            self.vectors = self.graph = None
+            self.__map__()
+
+    @property
+    def live(self) -> int:
+        return len(self.slots)
+
+    def __map__(self) -> None:
+        if self.capacity:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dimension))
+            self.graph = np.memmap(self.graph_path, dtype=np.int32, mode="r+", shape=(self.capacity, self.neighbors))
+
+    def __grow__(self, required: int) -> None:
+        if required <= self.capacity:
+            return
+
+        old_capacity = self.capacity
+        self.capacity = max(required, self.capacity * 2, 1024)
+        self.vectors = self.graph = None
+
+        # Growing the files in place keeps existing rows, new bytes read back as zeros
+        for path, row_bytes in ((self.vectors_path, cast(int, self.dimension) * 4), (self.graph_path, self.neighbors * 4)):
+            with open(path, "ab") as f:
+                f.truncate(self.capacity * row_bytes)
+
+        self.__map__()
+        self.graph[old_capacity:] = -1
+
+    def save(self) -> None:
+        if self.capacity:
+            self.vectors.flush()
+            self.graph.flush()
+
+        self.journal.checkpoint({"dimension": self.dimension, "capacity": self.capacity, "count": self.count, "entry": self.entry, "linked": self.linked, "ids": self.ids, "metadata": self.metadata})
+
+    def commit(self) -> None:
+        # Call with the exclusive journal lock held, the batch was applied after a refresh
+        if self.capacity:
+            self.vectors.flush()
+            self.graph.flush()
+
+        entry = {"dimension": self.dimension, "capacity": self.capacity, "count": self.count, "entry": self.entry, "linked": self.linked, **self.changes}
+        self.changes = {"upsert": [], "delete": []}
+        if self.rewritten or self.journal.append(entry):
+            self.rewritten = False
+            self.save()
+
+    def upsert(self, vector_ids: List[str], vectors: np.ndarray, metadata: List[Dict[str, Any]], ef: int = LOCAL_ANN_EF_CONSTRUCTION) -> None:
+        if self.dimension is None:
+            self.dimension = int(vectors.shape[1])
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(f"Vector dimension {vectors.shape[1]} does not match the namespace dimension {self.dimension}")
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        self.__grow__(self.count + len(vector_ids))
+        for vector_id, vector, fields in zip(vector_ids, vectors, metadata):
+            slot = self.slots.get(vector_id)
+            if slot is None:
+                slot = self.count
+                self.count += 1
+                self.ids.append(vector_id)
+                self.metadata.append(fields)
+                self.slots[vector_id] = slot
+            else:
+                self.metadata[slot] = fields
+            self.changes["upsert"].append([slot, vector_id, fields])
+
+            self.vectors[slot] = vector
+            if self.linked:
+                self.__link__(slot, ef)
+
+    @property
+    def needs_graph(self) -> bool:
+        # The graph is only built once the namespace outgrows exact scans, then kept up to date per insert
+        return not self.linked and self.live > LOCAL_ANN_MIN_VECTORS
+
+    def install_graph(self, built: SmallWorldGraph, ef: int = LOCAL_ANN_EF_CONSTRUCTION) -> bool:
+        """Swaps in a graph built from an earlier copy of the rows. Call with the exclusive journal lock held.
+
+        Returns False when a compaction moved the rows since the copy was taken."""
+        count = len(built.ids)
+        if self.count < count or built.vectors.shape[1] != self.dimension:
+            return False
+        if any(vector_id is not None and vector_id != built.ids[slot] for slot, vector_id in enumerate(self.ids[:count])):
+            return False
+
+        # Rows upserted while the graph was built are linked the same way as a regular insert
+        changed = np.flatnonzero(np.any(np.asarray(self.vectors[:count]) != built.vectors, axis=1)).tolist()
+        self.graph[:count] = built.graph
+        self.entry = built.entry if built.entry >= 0 and self.ids[built.entry] is not None else next(iter(self.slots.values()), -1)
+        for slot in changed + list(range(count, self.count)):
+            if self.ids[slot] is not None:
+                self.__link__(slot, ef)
+        self.linked = True
+        return True
+
+    def __forget__(self, vector_ids: List[str]) -> None:
+        for vector_id in vector_ids:
+            slot = self.slots.pop(vector_id, None)
+            if slot is not None:
+                self.ids[slot] = None
+                self.metadata[slot] = None
+
+    def delete(self, vector_ids: List[str]) -> None:
+        self.__forget__(vector_ids)
+        self.changes["delete"].extend(vector_ids)
+
+        if self.entry >= 0 and self.ids[self.entry] is None:
+            self.entry = next(iter(self.slots.values()), -1)
+
+        if self.count >= 1024 and self.live < self.count // 2:
+            self.compact()
+
+    def compact(self) -> None:
+        live = sorted(self.slots.values())
+        vector_ids = [cast(str, self.ids[slot]) for slot in live]
+        metadata = [self.metadata[slot] or {} for slot in live]
+        vectors = np.array(self.vectors[live]) if live else np.zeros((0, cast(int, self.dimension)), dtype=np.float32)
+
+        self.count, self.entry, self.linked = 0, -1, False
+        self.ids, self.metadata, self.slots = [], [], {}
+        if self.capacity:
+            self.graph[:] = -1
+        if vector_ids:
+            self.upsert(vector_ids, vectors, metadata)
+        # Every slot moved, so the next commit writes a checkpoint instead of journaling the batch
+        self.rewritten = True
+        log.log_event("SYSTEM", f"[VECTOR STORE] Compacted {self.directory} to {len(vector_ids)} vectors")
+
+    def search(self, query: np.ndarray, top_k: int, ef: int = LOCAL_ANN_EF_SEARCH) -> List[Tuple[str, float, Dict[str, Any]]]:
+        if not self.live or query.shape[0] != self.dimension:
+            return []
+
+        norm = float(np.linalg.norm(query))
+        query = query / norm if norm else query
+
+        # Small namespaces are scanned exactly, the graph only pays off once a scan gets expensive
+        if not self.linked or self.live <= LOCAL_ANN_MIN_VECTORS:
+            scores = np.asarray(self.vectors[:self.count] @ query)
+            scores[[slot for slot, vector_id in enumerate(self.ids) if vector_id is None]] = -np.inf
+            k = min(top_k, self.live)
+            top = np.argpartition(-scores, k - 1)[:k]
+            ranked = [(float(scores[slot]), int(slot)) for slot in top[np.argsort(-scores[top])]]
+        else:
+            ranked = [(score, slot) for score, slot in self.__graph_search__(query, max(ef, top_k)) if self.ids[slot] is not None][:top_k]
+
+        # Rows sharing nothing with the query would still earn rank credit once fused with the lexical results
+        ranked = [(score, slot) for score, slot in ranked if score > 0]
+
+        return [(cast(str, self.ids[slot]), score, self.metadata[slot] or {}) for score, slot in ranked]
+
+class LocalVectorStore(VectorStore):
+    def __init__(self, path: str, embed: Callable[[List[str]], np.ndarray] | None = None, text_field: str = "text") -> None:
+        self.path = path
+        self.embed = embed
+        self.text_field = text_field
+        self.namespaces: Dict[str, LocalNamespace] = {}
+        self.building: Set[str] = set()
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+    @contextmanager
+    def __namespace__(self, namespace: str, exclusive: bool = False) -> Iterator[LocalNamespace]:
+        if namespace not in self.namespaces:
+            self.namespaces[namespace] = LocalNamespace(os.path.join(self.path, namespace))
+        store = self.namespaces[namespace]
+
+        # Other workers write to the same files, so every access first replays what they appended
+        with store.journal.locked(exclusive=exclusive):
+            store.refresh()
+            yield store
+
+    def __build_graph__(self, namespace: str) -> None:
+        # Building the graph of a large namespace takes minutes, so it runs on a copy of the rows without holding
+        # either lock, and the result is swapped in afterwards
+        with self.lock, self.__namespace__(namespace) as store:
+            if not store.needs_graph or namespace in self.building:
+                return
+            self.building.add(namespace)
+            built = SmallWorldGraph(np.array(store.vectors[:store.count]), list(store.ids[:store.count]), store.neighbors)
+
+        try:
+            built.build()
+            with self.lock, self.__namespace__(namespace, exclusive=True) as store:
+                if not store.needs_graph:
+                    return
+                if not store.install_graph(built):
+                    log.log_event("SYSTEM", f"[VECTOR STORE] Discarded the graph for {store.directory}, the namespace was compacted while it was built")
+                    return
+                store.commit()
+                log.log_event("SYSTEM", f"[VECTOR STORE] Built the graph for {store.directory} over {store.live} vectors")
+        finally:
+            with self.lock:
+                self.building.discard(namespace)
+
+    def upsert(self, namespace: str, records: List[Dict[str, Any]]) -> None:
+        if not records:
+            return
+
+        if "values" in records[0]:
+            vectors = np.asarray([record["values"] for record in records], dtype=np.float32)
+        elif self.embed is not None:
+            vectors = self.embed([record[self.text_field] for record in records])
+        else:
+            raise ValueError("Records need values when the store has no embedder")
+
+        metadata = [{key: value for key, value in record.items() if key not in ("_id", "values")} for record in records]
+        with self.lock, self.__namespace__(namespace, exclusive=True) as store:
+            store.upsert([record["_id"] for record in records], vectors, metadata)
+            store.commit()
+        self.__build_graph__(namespace)
+
+    def search(self, namespace: str, top_k: int, vector: List[float] | None = None, text: str | None = None, fields: List[str] | None = None) -> List[Dict[str, Any]]:
+        if vector is not None:
+            query = np.asarray(vector, dtype=np.float32)
+        elif text is not None and self.embed is not None:
+            query = self.embed([text])[0]
+        else:
+            raise ValueError("Provide a vector, or text when the store has an embedder")
+
+        with self.lock, self.__namespace__(namespace) as store:
+            matches = store.search(query, top_k)
+
+        return [
+            {"id": vector_id, "score": score, "fields": {key: value for key, value in metadata.items() if fields is None or key in fields}}
+            for vector_id, score, metadata in matches
+        ]
+
+    def fetch(self, namespace: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self.lock, self.__namespace__(namespace) as store:
+            return {vector_id: dict(store.metadata[store.slots[vector_id]] or {}) for vector_id in ids if vector_id in store.slots}
+
+    def delete(self, namespace: str, ids: List[str]) -> None:
+        with self.lock, self.__namespace__(namespace, exclusive=True) as store:
+            store.delete(ids)
+            store.commit()
+        # A compaction drops the graph
+        self.__build_graph__(namespace)
+
+    def list_ids(self, namespace: str, prefix: str = "") -> List[str]:
+        with self.lock, self.__namespace__(namespace) as store:
+            return [vector_id for vector_id in store.slots if vector_id.startswith(prefix)]
+
+    def delete_namespace(self, namespace: str) -> None:
+        with self.lock, self.__namespace__(namespace, exclusive=True) as store:
+            store.vectors = store.graph = None
+            for file_path in (store.vectors_path, store.graph_path):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            store.journal.remove()
+            del self.namespaces[namespace]
+
+def create_vector_stores(backend: str = VECTOR_STORE) -> Tuple[VectorStore, VectorStore]:
+    if backend == "local":
+        log.log_event("SYSTEM", f"[VECTOR STORE] Using the local store at {VECTOR_STORE_PATH}")
+        return (
+            LocalVectorStore(os.path.join(VECTOR_STORE_PATH, "text"), embed=HashingEmbedder()),
+            LocalVectorStore(os.path.join(VECTOR_STORE_PATH, "images")),
+        )
+
+    if backend != "pinecone":
+        raise ValueError(f"Unknown vector store backend {backend}")
+
+    pc = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
+    log.log_event("SYSTEM", "Connected to PineconeDB")
+    return (
+        PineconeVectorStore(pc.Index(str(os.environ.get("PINECONE_INDEX_NAME"))), integrated_embedding=True),
+        PineconeVectorStore(pc.Index(str(os.environ.get("PINECONE_IMAGES_INDEX_NAME")))),
+    )